@@ -1,153 +1,176 @@
 from fetch import main as fetch_data
-from segment import segment_conversation
+from segment import SEGMENT_COLUMNS, preprocess_data, segment_export
+from export_reader import iter_conversation_blocks, read_export
+from shard import map_shards, merge_shards, partition_export, read_shard
+from transfer import detect_transfers
+from dedup import cluster_segments
+from retrieval import DOCUMENT_ID_CC_SALES, iter_policies
+from local_index import PolicyIndex, iter_local_policies, load_snapshot
+from cache import DEFAULT_CACHE_PATH, ResponseCache, cache_key
+from checkpoint import JsonlSink, occurrence_keys
+from intermediate import FrameSink, frame_exists, read_frame, write_frame
+from metrics import METRICS
+from incremental import clustered_on, load_state, merge_delta, save_state, scan_export, state_path, write_delta_export
 import pandas as pd
-import re
 from r2r import R2RClient
 import json
+import os
+import tempfile
+from functools import partial
 
-DOCUMENT_ID_CC_SALES="d25939ce-cae7-5636-9f04-4345f7f9c088"
-
-def preprocess_data(df):
-    #sort by conversation id and message sent time
-    df=df.sort_values(by=['Conversation ID', 'Message Sent Time'])
-    #drop duplicates
-    df=df.drop_duplicates(subset=['Conversation ID', 'Message Sent Time'],keep='first')
-    return df
-
-def extract_messages(text, max_messages=3):
+def segment_shard(shard_path, vectorized=True, arrow=True):
     """
-    Extract up to max_messages from text, where each message starts with 'Agent:', 'Consumer:', or 'Bot:'
+    Segment one shard of the export and detect its transfers, in a worker process.
+    Both frames are written next to the shard and only their basenames are sent back.
     """
-    # Split by message prefixes and keep the prefix
-    pattern = r'(Agent:|Consumer:|Bot:)'
-    parts = re.split(pattern, text)
-    
-    messages = []
-    for i in range(1, len(parts), 2):  # Skip first empty part, then take prefix + content pairs
-        if i + 1 < len(parts):
-            prefix = parts[i]
-            content = parts[i + 1].strip()
-            if content:  # Only add if there's actual content
-                messages.append(prefix + content)
-                if len(messages) >= max_messages:
-                    break
-    
-    return messages
+    base = os.path.splitext(shard_path)[0]
+    write_frame(segment_export(read_shard(shard_path), vectorized), f"{base}-segmented", arrow=arrow, csv=False)
+    transfers = detect_transfers(read_frame(f"{base}-segmented", arrow=arrow), max_messages=3)
+    write_frame(transfers, f"{base}-transfers", arrow=arrow, csv=False)
+    return f"{base}-segmented", f"{base}-transfers"
 
-def main(view_name="Sales CC"):
+def main(view_name="Sales CC", vectorized=True, r2r_url="http://localhost:7272", concurrency=8, rate_limit=None,
+         cache_path=DEFAULT_CACHE_PATH, bypass_cache=False, chunksize=None, sorted_export=False, arrow=True, export_csv=True,
+         processes=1, retrieval="r2r", dedup_threshold=None, incremental=False, metrics_file=None, prometheus_file=None):
     # Step 1: Fetch data
     # fetch_data(view_name)
     #Step 2: Segment conversations
+    # stages hand their output to the next one as Arrow files (arrow=True, needs pyarrow),
+    # CSV copies are written for humans when export_csv is set
     csv_filename = f"{view_name}.csv"
-    df = pd.read_csv(csv_filename)
-    df = preprocess_data(df)
-
-    all_segments = []
-    for conv_id, conv_data in df.groupby("Conversation ID"):
-                conv_data = conv_data[conv_data["Message Type"] == "Normal Message"]
-                segments = segment_conversation(conv_data)
-                for agent, last_skill, segment_messages in segments:
-                    all_segments.append([conv_id, last_skill, agent, "\n".join(segment_messages)])
+    suffix = ""
+    if incremental:
+        # only new conversations and ones with messages after the watermark go through the stages, as a delta
+        # export merged into the full outputs at the end; clusters would only cover the delta, so no dedup
+        if dedup_threshold:
+            print("✗ dedup_threshold is ignored in incremental runs")
+            dedup_threshold = None
+        with METRICS.stage("incremental_scan") as stage:
+            state = load_state(state_path(view_name))
+            delta_ids, watermark = scan_export(csv_filename, state, chunksize=chunksize or 100_000)
+            # rows an earlier full run clustered onto a changed conversation would keep its stale results
+            transfers_basename = f"{view_name}-transfered_with_messages"
+            if frame_exists(transfers_basename, arrow=arrow):
+                delta_ids |= clustered_on(read_frame(transfers_basename, arrow=arrow), delta_ids)
+            delta_rows = stage.rows = write_delta_export(csv_filename, delta_ids, f"{view_name}-delta.csv", chunksize=chunksize or 100_000)
+        print(f"✓ {len(delta_ids)} new or changed conversations ({delta_rows} rows) since {state['watermark']}")
+        csv_filename = f"{view_name}-delta.csv"
+        suffix = "-delta"
+    segmented_basename = f"{view_name}-segmented_conversations{suffix}"
+    if processes > 1:
+        # hash-partition the export by conversation, segment and detect transfers of every shard on its own process
+        with METRICS.stage("segment_and_transfers") as stage, tempfile.TemporaryDirectory() as shard_dir:
+            shard_paths = partition_export(csv_filename, processes, shard_dir, chunksize=chunksize or 100_000)
+            outputs = map_shards(partial(segment_shard, vectorized=vectorized, arrow=arrow), shard_paths, processes)
+            segmented_df = merge_shards([read_frame(segmented, arrow=arrow) for segmented, _ in outputs])
+            df_transfered_with_messages = merge_shards([read_frame(transfers, arrow=arrow) for _, transfers in outputs])
+            stage.rows = len(segmented_df)
+        write_frame(segmented_df, segmented_basename, arrow=arrow, csv=export_csv)
+    else:
+        with METRICS.stage("segment") as stage, \
+                FrameSink(segmented_basename, SEGMENT_COLUMNS, arrow=arrow, csv=export_csv) as segmented_sink:
+            if chunksize:
+                # stream the export chunksize rows at a time and segment complete conversations as they arrive,
+                # an unsorted export is sorted on disk first unless sorted_export is set
+                for block in iter_conversation_blocks(csv_filename, chunksize=chunksize, sorted_export=sorted_export):
+                    segments = segment_export(block, vectorized)
+                    segmented_sink.write(segments)
+                    stage.rows += len(segments)
+            else:
+                df = read_export(csv_filename)
+                segments = segment_export(df, vectorized)
+                segmented_sink.write(segments)
+                stage.rows = len(segments)
+        #Step 3: Detect transfers
+        segmented_df = read_frame(segmented_basename, arrow=arrow)
 
-    segmented_filename = f"{view_name}-segmented_conversations.csv"
-    segmented_df = pd.DataFrame(all_segments, columns=["Conversation ID", "Last Skill", "Agent Name ", "Messages"])
-    # remove segments with no "Consumer:" Messages
-    segmented_df = segmented_df[segmented_df["Messages"].str.contains("Consumer:")]
-    #save the segmented_df to a csv file
-    segmented_df.to_csv(segmented_filename, index=False)
-    #Step 3: Detect transfers
-    segmented_df = pd.read_csv(segmented_filename)
-    
-    
+        #step 4: for every BOT segment handed over to an agent, append the first messages of the agent's segment
+        with METRICS.stage("transfers") as stage:
+            df_transfered_with_messages = detect_transfers(segmented_df, max_messages=3)
+            stage.rows = len(segmented_df)
 
-    #step 4: for every conversation in transfer_df, get the messages from segmented_df and store it in a new row in a new dataframe named df_transfered_with_messages
-    df_transfered_with_messages = pd.DataFrame(columns=["Conversation ID", "Last Skill", "Agent Name ", "Messages"])
-    # Get unique conversation IDs to avoid duplicate processing
-    unique_conv_ids = segmented_df["Conversation ID"].unique()
-    for conv_id in unique_conv_ids:
-        conv_df = segmented_df[segmented_df["Conversation ID"] == conv_id]
-        # skip if only one row regardless of the agent name
-        if len(conv_df) == 1 and conv_df["Agent Name "].iloc[0] == "BOT":
-            continue
-        # If there are multiple rows, add all BOT rows except the last one
-        elif len(conv_df) > 1:
-            # process rows by row, if the agent name is BOT, and next row is not BOT, add the row to the dataframe
-            for i in range(len(conv_df)):
-                if i < len(conv_df) - 1 and conv_df.iloc[i]["Agent Name "] == "BOT" and conv_df.iloc[i+1]["Agent Name "] != "BOT":
-                    # Get current BOT row
-                    current_row = conv_df.iloc[i].copy()
-                    current_messages = current_row["Messages"]
-                    
-                    # Extract up to 3 messages from the next row
-                    next_row_messages = conv_df.iloc[i+1]["Messages"]
-                    extracted_messages = extract_messages(next_row_messages, max_messages=3)
-                    
-                    # Combine messages
-                    if extracted_messages:
-                        combined_messages = current_messages + "\n" + "\n".join(extracted_messages)
-                        current_row["Messages"] = combined_messages
-                    
-                    # Add the modified row to the dataframe
-                    df_transfered_with_messages = pd.concat([df_transfered_with_messages, pd.DataFrame([current_row])], ignore_index=True)
-    
-    transfered_filename = f"{view_name}-transfered_with_messages.csv"
-    df_transfered_with_messages.to_csv(transfered_filename, index=False)
+    # with dedup_threshold set (e.g. 0.9), near-duplicate rows share the results of their "Cluster ID" row
+    # lossy (consumer names are not masked), so off by default
+    keys = list(occurrence_keys(df_transfered_with_messages["Conversation ID"]))
+    if dedup_threshold:
+        with METRICS.stage("dedup") as stage:
+            # the transfer rows are BOT segments, the agents whose greetings they end with are in the human segments
+            agent_names = segmented_df.loc[segmented_df["Agent Name "] != "BOT", "Agent Name "].dropna().unique()
+            representatives = cluster_segments(
+                df_transfered_with_messages["Messages"].tolist(),
+                threshold=dedup_threshold,
+                names=agent_names
+            )
+            stage.rows = len(keys)
+        df_transfered_with_messages["Cluster ID"] = [keys[r] for r in representatives]
+        print(f"✓ {len(set(representatives))} clusters for {len(keys)} rows")
+    else:
+        df_transfered_with_messages["Cluster ID"] = keys
+    write_frame(df_transfered_with_messages, f"{view_name}-transfered_with_messages{suffix}", arrow=arrow, csv=export_csv)
 
 
 
-    # run r2r on every row in the transfered_with_messages dataframe
-    Prompt = """
-Based on the ingested document, return a JSON object summarizing all relevant policies, instructions, or rules that apply to this conversation.
+    # run r2r on every row in the transfered_with_messages dataframe, keeping up to `concurrency` requests in flight
+    # unchanged chats are answered from the on-disk cache; retrieval="local" ranks a local snapshot of the policies
+    client = R2RClient(base_url=r2r_url)
+    cache = ResponseCache(cache_path, bypass=bypass_cache) if cache_path and retrieval == "r2r" else None
+    # every finished row is appended to the checkpoint, a restarted run skips rows already in it
+    # as long as the row (and for cluster members, their representative's row) is unchanged
+    result_columns = ["Conversation ID", "Last Skill", "Agent Name ", "Messages", "Cluster ID", "Results"]
+    rows = df_transfered_with_messages[result_columns[:-1]].to_dict("records")
+    clusters = df_transfered_with_messages["Cluster ID"].tolist()
+    own = {key: cache_key("main.row", retrieval, DOCUMENT_ID_CC_SALES, row) for key, row in zip(keys, rows)}
+    fingerprints = {key: own[key] if cluster == key else cache_key(own[key], own[cluster]) for key, cluster in zip(keys, clusters)}
+    with JsonlSink(f"{view_name}-r2r-results{suffix}.jsonl", fingerprints) as sink:
+        if sink.index:
+            print(f"✓ Resuming: {len(sink.index)} rows already retrieved")
+        pending = [position for position, key in enumerate(keys) if key not in sink.index and clusters[position] == key]
+        chats = [rows[position]["Messages"] for position in pending]
+        if retrieval == "local":
+            results = iter_local_policies(PolicyIndex(*load_snapshot(client, DOCUMENT_ID_CC_SALES)), chats)
+        else:
+            results = iter_policies(
+                client,
+                chats,
+                DOCUMENT_ID_CC_SALES,
+                concurrency=concurrency,
+                rate_limit=rate_limit,
+                cache=cache
+            )
+        with METRICS.stage("retrieval") as stage:
+            for i, completion in results:
+                position = pending[i]
+                sink.append(keys[position], {**rows[position], "Results": completion})
+                stage.rows += 1
+        # fan the results of every representative out to the other rows of its cluster
+        members = [position for position, key in enumerate(keys) if key not in sink.index and clusters[position] in sink.index]
+        for position, record in zip(members, sink.iter_records([clusters[position] for position in members])):
+            sink.append(keys[position], {**rows[position], "Results": record["Results"]})
+        # compact the checkpoint into the results files, in transfer order
+        with FrameSink(f"{view_name}-r2r-results{suffix}", result_columns, arrow=arrow, csv=export_csv) as results_sink:
+            results_sink.write_records(sink.iter_records(keys))
+        # the checkpoint only serves an interrupted run, the next run starts from the results files
+        sink.remove()
+    if cache:
+        print(f"✓ R2R cache: {json.dumps(cache.stats())}")
+        cache.close()
 
-Guidelines:
-•⁠  ⁠*Customer Intent Matching:* Whether the policy addresses the customer's specific inquiry, complaint, or issue.
-•⁠  ⁠*Keyword Overlap:* Presence of relevant terms (sickness, pain, hospitals, symptoms, doctor, visa processing, service fees, salaries, etc.).
-•⁠  ⁠*Bot Response Appropriateness:* How well the policy supports or validates the customer service responses provided.
-•⁠  ⁠*Communication Style:* Policy alignment with professional WhatsApp standards, including the use of emojis (indicated by ⁠ :: ⁠ like ⁠ :happy: ⁠), jargon, or informal language.
-•⁠  ⁠*Process Relevance:* How well the policy covers relevant processes mentioned in the conversation.
-•⁠  ⁠*Exclusion Criterion*: If the policy is primarily about the procedures for filing complaints or making a chat transfer, assign a relevance score of 0.00.
-•⁠  ⁠If no policies are relevant, return a JSON object containing an empty list.
-# Output Requirements and schema:
-For each selected policy:
-•⁠  ⁠Title: Use the policy's official title.
-•⁠  ⁠Relevance Score: The calculated score (float between 0.00 and 1.0, 1.0 being the highest).
-•⁠  ⁠Excerpt: Extract the most relevant portion explaining the core policy rule or guideline.
-•⁠  ⁠Exceptions: If the policy has exceptions or special cases, include them in the output.
+    if incremental:
+        # replace the rows of the delta conversations in the full outputs, Stage2 then evaluates
+        # only "{view_name}-r2r-results-delta" (see its --delta option)
+        for name in ["segmented_conversations", "transfered_with_messages", "r2r-results"]:
+            basename = f"{view_name}-{name}"
+            existing = read_frame(basename, arrow=arrow) if frame_exists(basename, arrow=arrow) else None
+            merged = merge_delta(existing, read_frame(f"{basename}-delta", arrow=arrow), delta_ids)
+            write_frame(merged, basename, arrow=arrow, csv=export_csv)
+        save_state(state_path(view_name), watermark, state["conversations"] | delta_ids)
+        print(f"✓ Merged {len(delta_ids)} conversations, watermark {watermark}")
 
-Respond ONLY with a valid JSON object. Do not include any other text, explanation, or example.
-
-Here is the input conversation. Apply the above instructions accordingly. Do not include references.
-{chat}
-"""
-    
-    client = R2RClient(base_url="http://localhost:7272")
-    results=[]
-    for index, row in df_transfered_with_messages.iterrows():
-        chat=row["Messages"]
-        prompt=Prompt.format(chat=chat)
-        response = client.retrieval.rag(
-            query=prompt,
-            search_settings={
-                "search_strategy": "rag_fusion",
-                "limit": 20,
-                "search_mode": "advanced",
-                "filter":{
-                    "document_id": DOCUMENT_ID_CC_SALES
-                }
-            }
-        )
-        results.append(
-            {
-                "Conversation ID":row["Conversation ID"],
-                "Last Skill":row["Last Skill"],
-                "Agent Name ":row["Agent Name "],
-                "Messages":row["Messages"],
-                "Results":response.results.completion
-            }
-        )
-    df_results=pd.DataFrame(results,columns=["Conversation ID", "Last Skill", "Agent Name ", "Messages", "Results"])
-    df_results.to_csv(f"{view_name}-r2r-results.csv",index=False)
+    # the JSON run summary is only written when metrics_file is given
+    if metrics_file:
+        METRICS.write_summary(metrics_file)
+    if prometheus_file:
+        METRICS.write_prometheus(prometheus_file)
 
 if __name__ == '__main__':
     main()
-
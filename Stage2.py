@@ -1,39 +1,137 @@
+import argparse
 import csv
 import json
 import os
 import dotenv
 import requests
-import re
+import time
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from cache import DEFAULT_CACHE_PATH, ResponseCache, cache_key, normalize_text
+from checkpoint import JsonlSink, imap_unordered, occurrence_keys
+from intermediate import is_arrow_path, iter_rows
+from batch_backend import FINAL_BATCH_STATUSES, FakeBatchBackend, OpenAIBatchBackend
+from metrics import METRICS
+from result_store import ResultRecord, decode_first_object, iter_result_records, iter_stored_results, write_results
+from packing import PACKED_INSTRUCTIONS, PackItem, estimate_tokens, pack_items, packed_payload, parse_packed_output
 
 dotenv.load_dotenv()
 
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', "https://api.openai.com/v1")
+OPENAI_API_URL = os.getenv('OPENAI_API_URL', f"{OPENAI_BASE_URL}/chat/completions")
+OPENAI_MODEL = "gpt-4o"
+# column names of Main's r2r results as read by this stage
+MAIN_COLUMN_NAMES = {"Conversation ID": "Conversation Id", "Results": "Policies"}
+# rate limiting and transient server errors are retried, honouring Retry-After when present
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+FINAL_COLUMNS = ["conv_id", "Messages", "policies_related", "policies_violated", "policies_high_relevance"]
+NO_POLICIES_ERROR = "Could not extract valid JSON from policies field."
+
 def extract_json_from_policies(policies):
     """
     Extract the first JSON object from a string, ignoring any markdown/code block wrappers or extra text.
     """
-    if not policies:
-        return {}
-    # Remove markdown code block markers and leading/trailing whitespace
-    cleaned = policies.strip()
-    cleaned = re.sub(r'^```json', '', cleaned, flags=re.IGNORECASE).strip()
-    cleaned = re.sub(r'^```', '', cleaned).strip()
-    cleaned = re.sub(r'```$', '', cleaned).strip()
-    # Find the first JSON object in the string
-    match = re.search(r'\{.*\}', cleaned, re.DOTALL)
-    if match:
-        json_str = match.group(0)
-        try:
-            return json.loads(json_str)
-        except Exception as e:
-            return {}
-    return {}
+    return decode_first_object(policies) or {}
 
-def process_csv(input_csv, output_file, prompt, api_key):
-    """Process the CSV file and generate output based on the given prompt."""
-    try:
-        with open(input_csv, 'r', encoding='utf-8') as csvfile:
+def read_rows(input_path):
+    """
+    Yield the rows of the r2r results as dicts, from a CSV or from the Arrow file written by Main.
+    Main's column names are renamed to the ones used here, and missing Arrow values become empty strings.
+    """
+    if is_arrow_path(input_path):
+        for row in iter_rows(input_path):
+            yield {MAIN_COLUMN_NAMES.get(name, name): "" if value is None else value for name, value in row.items()}
+    else:
+        with open(input_path, 'r', encoding='utf-8') as csvfile:
             reader = csv.DictReader(csvfile)
-            rows = list(reader)
+            if reader.fieldnames:
+                reader.fieldnames = [MAIN_COLUMN_NAMES.get(name, name) for name in reader.fieldnames]
+            yield from reader
+
+def row_clusters(input_csv, keys):
+    """
+    Key of the row each row shares its evaluation with: its "Cluster ID" (see Main's dedup stage),
+    or its own key when the input has no clusters or the cluster key is not one of the input's keys.
+    """
+    known = set(keys)
+    return [row.get('Cluster ID') if row.get('Cluster ID') in known else key for key, row in zip(keys, read_rows(input_csv))]
+
+def row_fingerprints(input_csv, keys, clusters, prompt):
+    """
+    Checkpoint fingerprint of every row (see JsonlSink): a digest of the model, prompt, Messages and
+    Policies it is evaluated with, combined with its representative's for rows sharing a cluster's result.
+    """
+    own = {
+        key: cache_key("stage2.row", OPENAI_MODEL, prompt, row.get('Messages', ''), row.get('Policies', ''))
+        for key, row in zip(keys, read_rows(input_csv))
+    }
+    return {key: own[key] if cluster == key else cache_key(own[key], own[cluster]) for key, cluster in zip(keys, clusters)}
+
+def parse_api_output(conversation_id, api_output):
+    """Parse the JSON answer of the model, tolerating a markdown code block around it."""
+    # --- Fix: Remove markdown code block before parsing ---
+    cleaned_output = api_output.strip()
+    if cleaned_output.startswith("```json"):
+        cleaned_output = cleaned_output[len("```json"):].strip()
+    if cleaned_output.startswith("```"):
+        cleaned_output = cleaned_output[len("```"):].strip()
+    if cleaned_output.endswith("```"):
+        cleaned_output = cleaned_output[:-3].strip()
+    try:
+        return json.loads(cleaned_output)
+    except json.JSONDecodeError as e:
+        print(f"✗ Error parsing API response for conversation {conversation_id}: {e}")
+        return {"error": f"Error parsing API response: {e}", "raw": api_output}
+
+def process_row(row, evaluate, record=None):
+    """
+    Evaluate one row of the r2r results and return its result entry, with the parsed policies as policies_data.
+    evaluate(messages, policies_data) returns the model's answer; record is the row's ResultRecord if parsed already.
+    """
+    conversation_id = row.get('Conversation Id', 'Unknown')
+    messages = row.get('Messages', '')
+    policies_data = (record or ResultRecord.from_row(row)).policies_data
+
+    try:
+        if not policies_data:
+            raise ValueError(NO_POLICIES_ERROR)
+        api_output = evaluate(messages, policies_data)
+        parsed_output = parse_api_output(conversation_id, api_output)
+        print(f"✓ Processed conversation {conversation_id}")
+        return {
+            "conversation_id": conversation_id,
+            "output": parsed_output,
+            "policies_data": policies_data
+        }
+    except Exception as e:
+        error_msg = f"Error: {e}"
+        METRICS.increment("errors_total", service="evaluation")
+        print(f"✗ Error processing conversation {conversation_id}: {e}")
+        return {
+            "conversation_id": conversation_id,
+            "output": {"error": error_msg},
+            "policies_data": policies_data
+        }
+
+def create_session(pool_size=8):
+    """Create a requests Session whose connection pool can serve pool_size concurrent requests."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def process_csv(input_csv, output_file, prompt, api_key, concurrency=1, cache=None, checkpoint_file=None,
+                pack_tokens=None, max_pack=8):
+    """
+    Process the CSV file and generate output based on the given prompt.
+    Results are checkpointed to checkpoint_file, so an interrupted run resumes where it stopped.
+    Returns the number of rows evaluated by this run.
+    """
+    checkpoint_file = checkpoint_file or os.path.splitext(output_file)[0] + ".jsonl"
+    try:
+        keys = list(occurrence_keys(row.get('Conversation Id', 'Unknown') for row in read_rows(input_csv)))
+        clusters = row_clusters(input_csv, keys)
     except FileNotFoundError:
         print(f"Error: The file {input_csv} was not found.")
         return
@@ -41,63 +139,105 @@ def process_csv(input_csv, output_file, prompt, api_key):
         print(f"Error reading the file {input_csv}: {e}")
         return
 
-    results = []
-    for row in rows:
-        conversation_id = row.get('Conversation Id', 'Unknown')
-        messages = row.get('Messages', '')
-        policies = row.get('Policies', '')
+    failed = {}
+    with JsonlSink(checkpoint_file, row_fingerprints(input_csv, keys, clusters, prompt)) as sink:
+        resumed = len(sink.index)
+        if sink.index:
+            print(f"✓ Resuming: {len(sink.index)} conversations already processed in {checkpoint_file}")
+        with create_session(pool_size=max(1, concurrency)) as session:
+            def evaluate(messages, policies_data):
+                return call_openai_api(messages, policies_data, prompt, api_key, session=session, cache=cache)
+
+            pending = (
+                (key, row) for key, cluster, row in zip(keys, clusters, read_rows(input_csv))
+                if key not in sink.index and cluster == key
+            )
+            if pack_tokens:
+                items = (
+                    PackItem(key, row, row.get('Messages', ''), decode_first_object(row.get('Policies', '')))
+                    for key, row in pending
+                )
+                packs = pack_items(items, pack_tokens, estimate_tokens(prompt + PACKED_INSTRUCTIONS), max_items=max_pack)
+                for _, results in imap_unordered(lambda pack: evaluate_pack(pack, prompt, api_key, session=session, cache=cache), packs, concurrency):
+                    for key, result in results:
+                        record_result(sink, failed, key, result)
+            else:
+                for (key, _), result in imap_unordered(lambda item: process_row(item[1], evaluate), pending, concurrency):
+                    record_result(sink, failed, key, result)
+        fan_out_clusters(sink, keys, clusters, read_rows(input_csv), failed)
 
+        # Write results to output file in JSON format
+        evaluated = len(sink.index) - resumed + len(failed)
         try:
-            # Use the new extraction function
-            policies_data = extract_json_from_policies(policies)
-            if not policies_data:
-                raise ValueError("Could not extract valid JSON from policies field.")
-            api_output = call_openai_api(messages, policies_data, prompt, api_key)
-            # --- Fix: Remove markdown code block before parsing ---
-            cleaned_output = api_output.strip()
-            if cleaned_output.startswith("```json"):
-                cleaned_output = cleaned_output[len("```json"):].strip()
-            if cleaned_output.startswith("```"):
-                cleaned_output = cleaned_output[len("```"):].strip()
-            if cleaned_output.endswith("```"):
-                cleaned_output = cleaned_output[:-3].strip()
-            try:
-                parsed_output = json.loads(cleaned_output)
-            except json.JSONDecodeError as e:
-                print(f"✗ Error parsing API response for conversation {conversation_id}: {e}")
-                parsed_output = {"error": f"Error parsing API response: {e}", "raw": api_output}
-            results.append({
-                "conversation_id": conversation_id,
-                "output": parsed_output
-            })
-            print(f"✓ Processed conversation {conversation_id}")
+            write_results(iter_results(sink, failed, keys), output_file)
+            print(f"✓ Results successfully saved to {output_file}")
         except Exception as e:
-            error_msg = f"Error: {e}"
-            print(f"✗ Error processing conversation {conversation_id}: {e}")
-            results.append({
-                "conversation_id": conversation_id,
-                "output": {"error": error_msg}
-            })
-
-    # Write results to output file in JSON format
-    try:
-        with open(output_file, 'w', encoding='utf-8') as jsonfile:
-            json.dump(results, jsonfile, indent=4, ensure_ascii=False)
-        print(f"✓ Results successfully saved to {output_file}")
-    except Exception as e:
-        print(f"Error writing to JSON file {output_file}: {e}")
+            print(f"Error writing to JSON file {output_file}: {e}")
+            return evaluated
+        if failed:
+            print(f"✗ {len(failed)} rows failed, they are not checkpointed in {checkpoint_file}: run again to retry them")
+        else:
+            sink.remove()
+        return evaluated
 
-def call_openai_api(messages, policies, prompt, api_key):
-    """Call the OpenAI API with the given messages, policies, and prompt."""
-    api_url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
+def is_failed(result):
+    """
+    Whether a result entry records an evaluation that got no answer from the API (an "Error..." answer or an
+    unexpected exception). Rows without valid policies and answers that are not JSON are final results.
+    """
+    output = result.get("output")
+    if not isinstance(output, dict) or "error" not in output:
+        return False
+    if "raw" in output:
+        return str(output["raw"]).startswith("Error")
+    return output["error"] != f"Error: {NO_POLICIES_ERROR}"
 
-    # Format the input for the API
-    data = {
-        "model": "gpt-4o",
+def record_result(sink, failed, key, result):
+    """Checkpoint a result; failed ones (see is_failed) are only kept in failed, so a resumed run retries them."""
+    if is_failed(result):
+        failed[key] = result
+    else:
+        sink.append(key, result)
+
+def iter_results(sink, failed, keys):
+    """Results of keys in order: the checkpointed ones, and the ones that failed in this run from failed."""
+    stored = sink.iter_records([key for key in keys if key not in failed])
+    for key in keys:
+        if key in failed:
+            yield failed[key]
+        elif key in sink.index:
+            yield next(stored)
+
+def fan_out_clusters(sink, keys, clusters, rows, failed):
+    """Give every row without a result the result of its cluster's representative, under its own conversation id."""
+    members = [
+        (key, cluster, row.get('Conversation Id', 'Unknown')) for key, cluster, row in zip(keys, clusters, rows)
+        if key not in sink.index and key not in failed and (cluster in sink.index or cluster in failed)
+    ]
+    for key, cluster, conversation_id in members:
+        if cluster in failed:
+            failed[key] = {**failed[cluster], "conversation_id": conversation_id}
+    members = [member for member in members if member[0] not in failed]
+    for (key, _, conversation_id), record in zip(members, sink.iter_records([cluster for _, cluster, _ in members])):
+        sink.append(key, {**record, "conversation_id": conversation_id})
+
+def retry_delay(response, attempt, backoff=1.0):
+    """Seconds to wait before retrying: the Retry-After header if present, else exponential backoff."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return backoff * 2 ** attempt
+
+def build_chat_request(messages, policies, prompt):
+    """Chat completion request body evaluating one conversation against its policies."""
+    return {
+        "model": OPENAI_MODEL,
         "messages": [
             {"role": "system", "content": prompt},
             {"role": "user", "content": f"Messages: {messages}\nPolicies: {json.dumps(policies, indent=2)}"},
@@ -105,25 +245,101 @@ def call_openai_api(messages, policies, prompt, api_key):
         "temperature": 0,
     }
 
-    try:
-        response = requests.post(api_url, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"].strip()
-    except requests.exceptions.RequestException as e:
-        return f"Error: {e}"
-    except KeyError as e:
-        return f"Error parsing API response: {e}"
-
-def generate_output_from_csv(input_csv, output_file):
-    """Main function to process the CSV and generate output."""
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key:
-        print("Error: Please set your OPENAI_API_KEY environment variable")
-        exit(1)
+def openai_cache_key(messages, policies, prompt):
+    """Cache key of an evaluation: the model, prompt, normalized chat and policies payload."""
+    return cache_key("openai.chat", OPENAI_MODEL, prompt, normalize_text(messages), policies)
+
+def call_openai_api(messages, policies, prompt, api_key, session=None, max_retries=5, timeout=300, cache=None):
+    """Call the OpenAI API with the given messages, policies, and prompt."""
+    # Format the input for the API
+    data = build_chat_request(messages, policies, prompt)
+    key = openai_cache_key(messages, policies, prompt) if cache else None
+    return post_chat_completion(data, api_key, session=session, max_retries=max_retries, timeout=timeout, cache=cache, key=key)
 
-    # PROMPT
-    prompt = """
+def post_chat_completion(data, api_key, session=None, max_retries=5, timeout=300, cache=None, key=None):
+    """Send a chat completion request with retries and return the answer, or an "Error: ..." string."""
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    api_url = OPENAI_API_URL
+    http = session or requests
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            response = http.post(api_url, headers=headers, json=data, timeout=timeout)
+            METRICS.observe("openai_request_seconds", time.perf_counter() - start)
+            if response.status_code in RETRY_STATUS_CODES and attempt < max_retries:
+                METRICS.increment("retries_total", service="openai", status=response.status_code)
+                delay = retry_delay(response, attempt)
+                print(f"✗ OpenAI API returned {response.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            response.raise_for_status()
+            result = response.json()
+            content = result["choices"][0]["message"]["content"].strip()
+            for name, tokens in (result.get("usage") or {}).items():
+                if isinstance(tokens, int):
+                    METRICS.increment("tokens_total", tokens, service="openai", kind=name.replace("_tokens", ""))
+            if cache:
+                cache.set(key, content)
+            return content
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            METRICS.observe("openai_request_seconds", time.perf_counter() - start)
+            if attempt == max_retries:
+                METRICS.increment("errors_total", service="openai", status=type(e).__name__)
+                return f"Error: {e}"
+            METRICS.increment("retries_total", service="openai", status=type(e).__name__)
+            delay = retry_delay(None, attempt)
+            print(f"✗ OpenAI API request failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+        except requests.exceptions.RequestException as e:
+            status = e.response.status_code if getattr(e, "response", None) is not None else type(e).__name__
+            METRICS.increment("errors_total", service="openai", status=status)
+            return f"Error: {e}"
+        except KeyError as e:
+            METRICS.increment("errors_total", service="openai", status="bad_response")
+            return f"Error parsing API response: {e}"
+
+def evaluate_pack(pack, prompt, api_key, session=None, cache=None):
+    """Evaluate a pack of rows with one request, falling back to one request per row. Returns (key, result entry) pairs."""
+    def evaluate(messages, policies_data):
+        return call_openai_api(messages, policies_data, prompt, api_key, session=session, cache=cache)
+
+    if len(pack) > 1:
+        data = {
+            "model": OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": prompt + PACKED_INSTRUCTIONS},
+                {"role": "user", "content": packed_payload(pack)},
+            ],
+            "temperature": 0,
+        }
+        key = cache_key("openai.packed", data) if cache else None
+        answer = post_chat_completion(data, api_key, session=session, cache=cache, key=key)
+        outputs = parse_packed_output(answer, [item.key for item in pack])
+        if outputs is not None:
+            results = []
+            for item in pack:
+                conversation_id = item.row.get('Conversation Id', 'Unknown')
+                print(f"✓ Processed conversation {conversation_id}")
+                results.append((item.key, {
+                    "conversation_id": conversation_id, "output": outputs[item.key], "policies_data": item.policies_data
+                }))
+            return results
+        print(f"✗ Unusable packed response for {len(pack)} conversations, evaluating them one by one")
+    return [
+        (item.key, process_row(item.row, evaluate, ResultRecord(item.row.get('Conversation Id'), item.messages, item.policies_data)))
+        for item in pack
+    ]
+
+# PROMPT
+COMPLIANCE_PROMPT = """
     You are an AI assistant tasked with analyzing conversations between a bot and users. Your goal is to evaluate whether the bot's responses in the conversation adhere to the provided company policies. If any violations are detected, you must identify the violated policies and summarize the nature of the violation.
     DO NOT OVERLOOK EXCEPTIONS in the policies, they are crucial for determining if a violation has occurred.
     YOU ONLY HAVE TO ASSESS THE BOT'S RESPONSES, NOT THE AGENT'S MESSAGES. If a bot violates a policy, you must detect the violation, even if the agent happened to correct that violation.
@@ -179,7 +395,141 @@ def generate_output_from_csv(input_csv, output_file):
     Analyze the conversation carefully and provide the output in the specified JSON format. Do not include any extra characters, markdown, or explanations outside the JSON object.
     """
 
-    process_csv(input_csv, output_file, prompt, api_key)
+def generate_output_from_csv(input_csv, output_file, concurrency=8, cache_path=DEFAULT_CACHE_PATH, bypass_cache=False,
+                             pack_tokens=None):
+    """Main function to process the CSV and generate output."""
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        print("Error: Please set your OPENAI_API_KEY environment variable")
+        exit(1)
+
+    prompt = COMPLIANCE_PROMPT
+
+    # unchanged conversations are answered from the on-disk cache, cache_path=None disables it
+    cache = ResponseCache(cache_path, bypass=bypass_cache) if cache_path else None
+    with METRICS.stage("evaluation") as stage:
+        stage.rows = process_csv(input_csv, output_file, prompt, api_key, concurrency=concurrency, cache=cache,
+                                 pack_tokens=pack_tokens) or 0
+    if cache:
+        print(f"✓ OpenAI cache: {json.dumps(cache.stats())}")
+        cache.close()
+
+def batch_paths(output_file):
+    """Batch input file and batch state file kept next to output_file."""
+    base = os.path.splitext(output_file)[0]
+    return f"{base}.batch-input.jsonl", f"{base}.batch.json"
+
+def submit_batch(input_csv, output_file, prompt, backend, checkpoint_file=None):
+    """
+    Submit one chat completion request per pending row (custom_id = row key) as a batch.
+    Returns the batch, or None when no request is left.
+    """
+    checkpoint_file = checkpoint_file or os.path.splitext(output_file)[0] + ".jsonl"
+    batch_input, batch_state = batch_paths(output_file)
+    keys = list(occurrence_keys(row.get('Conversation Id', 'Unknown') for row in read_rows(input_csv)))
+    clusters = row_clusters(input_csv, keys)
+    requests_count = 0
+    with JsonlSink(checkpoint_file, row_fingerprints(input_csv, keys, clusters, prompt)) as sink, \
+            open(batch_input, 'w', encoding='utf-8') as f:
+        for key, cluster, row in zip(keys, clusters, read_rows(input_csv)):
+            if key in sink.index or cluster != key:
+                continue
+            policies_data = extract_json_from_policies(row.get('Policies', ''))
+            if not policies_data:
+                continue
+            request = {
+                "custom_id": key,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": build_chat_request(row.get('Messages', ''), policies_data, prompt),
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            requests_count += 1
+    if not requests_count:
+        os.remove(batch_input)
+        print("✓ Nothing to submit, every row is already checkpointed or has no valid policies")
+        return None
+    batch = backend.create(backend.upload(batch_input))
+    with open(batch_state, 'w', encoding='utf-8') as f:
+        json.dump({"batch_id": batch["id"], "input_csv": input_csv, "prompt": prompt}, f)
+    print(f"✓ Submitted batch {batch['id']} with {requests_count} requests")
+    return batch
+
+def poll_batch(output_file, backend, wait=False, interval=60):
+    """Print the status of the submitted batch; with wait=True block until it reaches a final status."""
+    with open(batch_paths(output_file)[1], 'r', encoding='utf-8') as f:
+        batch_id = json.load(f)["batch_id"]
+    while True:
+        batch = backend.retrieve(batch_id)
+        print(f"Batch {batch_id}: {batch['status']} {json.dumps(batch.get('request_counts', {}))}")
+        if not wait or batch["status"] in FINAL_BATCH_STATUSES:
+            return batch
+        time.sleep(interval)
+
+def read_batch_outputs(backend, batch):
+    """Map the custom_id of every batch request to the model answer, or to an "Error: ..." string."""
+    outputs = {}
+    for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+        if not file_id:
+            continue
+        for line in backend.download(file_id).splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error")
+                outputs[record["custom_id"]] = f"Error: {error}"
+                continue
+            try:
+                outputs[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+            except (KeyError, IndexError) as e:
+                outputs[record["custom_id"]] = f"Error parsing API response: {e}"
+    return outputs
+
+def ingest_batch(input_csv, output_file, backend, checkpoint_file=None):
+    """Checkpoint the answers of a completed batch and write output_file like process_csv."""
+    checkpoint_file = checkpoint_file or os.path.splitext(output_file)[0] + ".jsonl"
+    with open(batch_paths(output_file)[1], 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    batch = backend.retrieve(state["batch_id"])
+    if batch["status"] != "completed":
+        print(f"Error: batch {batch['id']} is {batch['status']}, nothing to ingest")
+        return
+    outputs = read_batch_outputs(backend, batch)
+    keys = list(occurrence_keys(row.get('Conversation Id', 'Unknown') for row in read_rows(input_csv)))
+    clusters = row_clusters(input_csv, keys)
+    failed = {}
+    with JsonlSink(checkpoint_file, row_fingerprints(input_csv, keys, clusters, state.get("prompt", COMPLIANCE_PROMPT))) as sink:
+        for key, cluster, row in zip(keys, clusters, read_rows(input_csv)):
+            if key in sink.index:
+                continue
+            # rows of a cluster share the answer to its representative's request
+            answer = outputs.get(cluster, "Error: request missing from the batch output")
+            record_result(sink, failed, key, process_row(row, lambda messages, policies_data: answer))
+        write_results(iter_results(sink, failed, keys), output_file)
+        if not failed:
+            sink.remove()
+    print(f"✓ Results successfully saved to {output_file}")
+    if failed:
+        print(f"✗ {len(failed)} rows failed, submit a new batch to retry them")
+
+def merge_delta_output(input_csv, output_file, delta_output):
+    """Merge the evaluations of an incremental run into output_file, in the row order of input_csv."""
+    delta = list(iter_stored_results(delta_output))
+    previous = list(iter_stored_results(output_file)) if os.path.exists(output_file) else []
+    entries = {"delta": {}, "previous": {}}
+    for source, items in (("delta", delta), ("previous", previous)):
+        for item in items:
+            entries[source].setdefault(item.get("conversation_id"), []).append(item)
+    def merged():
+        for row in read_rows(input_csv):
+            conv_id = row.get('Conversation Id', 'Unknown')
+            source = entries["delta"] if conv_id in entries["delta"] else entries["previous"]
+            if source.get(conv_id):
+                yield source[conv_id].pop(0)
+    count = write_results(merged(), output_file)
+    print(f"✓ Merged {len(delta)} new evaluations into {output_file} ({count} entries)")
 
 def create_final_policies_csv(input_csv, processed_json, final_csv_path="final_policies.csv"):
     """
@@ -189,68 +539,67 @@ def create_final_policies_csv(input_csv, processed_json, final_csv_path="final_p
     - policies_violated: full value of the "output" key (as JSON string) from processed_output.json
     - policies_high_relevance: comma-separated policy titles from input_csv with relevance_score > 0.9
     """
-    # Load processed output
-    with open(processed_json, 'r', encoding='utf-8') as f:
-        processed = json.load(f)
-
-    # Map conversation_id to full output JSON
-    output_map = {}
-    for item in processed:
-        conv_id = item.get("conversation_id")
-        output = item.get("output", {})
-        output_map[conv_id] = json.dumps(output, ensure_ascii=False)
-
-    # Prepare and write the final CSV
-    with open(input_csv, 'r', encoding='utf-8') as infile, \
-         open(final_csv_path, 'w', newline='', encoding='utf-8') as outfile:
-        reader = csv.DictReader(infile)
-        fieldnames = [
-            "conv_id",
-            "Messages",
-            "policies_related",
-            "policies_violated",
-            "policies_high_relevance"
-        ]
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+    with METRICS.stage("final_csv") as stage, open(final_csv_path, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=FINAL_COLUMNS)
         writer.writeheader()
+        for record in iter_result_records(read_rows(input_csv), iter_stored_results(processed_json)):
+            writer.writerow(final_row(record))
+            stage.rows += 1
 
-        for row in reader:
-            conv_id = row.get("Conversation Id")
-            messages = row.get("Messages", "")
-            policies_field = row.get("Policies", "")
-            # Parse policies JSON and extract full "policies" value and high relevance titles
-            try:
-                cleaned = re.sub(r'^```json', '', policies_field.strip(), flags=re.IGNORECASE).strip()
-                cleaned = re.sub(r'^```', '', cleaned).strip()
-                cleaned = re.sub(r'```$', '', cleaned).strip()
-                policies_json = json.loads(cleaned)
-                policies_list = policies_json.get("policies", [])
-                # Pretty-print policies_related
-                policies_related = json.dumps(policies_list, indent=2, ensure_ascii=False)
-                high_rel_titles = [p.get("title", "") for p in policies_list if p.get("relevance_score", 0) > 0.9]
-            except Exception:
-                policies_related = ""
-                high_rel_titles = []
-
-            # Pretty-print policies_violated
-            policies_violated_raw = output_map.get(conv_id, "")
-            try:
-                policies_violated_json = json.loads(policies_violated_raw)
-                policies_violated = json.dumps(policies_violated_json, indent=2, ensure_ascii=False)
-            except Exception:
-                policies_violated = policies_violated_raw
-
-            writer.writerow({
-                "conv_id": conv_id,
-                "Messages": messages,
-                "policies_related": policies_related,
-                "policies_violated": policies_violated,
-                "policies_high_relevance": ",".join(high_rel_titles)
-            })
+def final_row(record):
+    """Row of the final CSV for a ResultRecord; a record without output gets an empty policies_violated."""
+    return {
+        "conv_id": record.conversation_id,
+        "Messages": record.messages,
+        "policies_related": json.dumps(record.policies, indent=2, ensure_ascii=False) if record.policies is not None else "",
+        "policies_violated": json.dumps(record.output, indent=2, ensure_ascii=False) if record.output is not None else "",
+        "policies_high_relevance": ",".join(record.high_relevance_titles)
+    }
 
 # Usage
 if __name__ == "__main__":
-    input_csv = 'Sales CC-r2r-results.csv'
-    output_file = 'Sales CC-r2r-results-processed.json'
-    generate_output_from_csv(input_csv, output_file)
-    create_final_policies_csv(input_csv, output_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate the r2r results against the compliance policies.")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "batch-submit", "batch-poll", "batch-ingest"],
+                        help="run evaluates synchronously; the batch-* commands use the OpenAI Batch API instead")
+    parser.add_argument("--input", default='Sales CC-r2r-results.csv')
+    parser.add_argument("--output", default='Sales CC-r2r-results-processed.json')
+    parser.add_argument("--wait", action="store_true", help="batch-poll: wait until the batch is finished")
+    parser.add_argument("--fake-batch-dir", help="use a local fake batch backend stored in this directory")
+    parser.add_argument("--pack-tokens", type=int, help="run: pack conversations into requests of about this many prompt tokens")
+    parser.add_argument("--delta", help="run: evaluate only the rows of this delta file written by an incremental Main run, "
+                                        "and merge them into --output")
+    parser.add_argument("--metrics-file", help="save the JSON run summary to this file")
+    parser.add_argument("--prometheus-file", help="also write the metrics in the Prometheus text format to this file")
+    args = parser.parse_args()
+    input_csv = args.input
+    output_file = args.output
+
+    if args.command == "run":
+        if args.delta:
+            delta_output = os.path.splitext(output_file)[0] + "-delta.json"
+            generate_output_from_csv(args.delta, delta_output, pack_tokens=args.pack_tokens)
+            merge_delta_output(input_csv, output_file, delta_output)
+        else:
+            generate_output_from_csv(input_csv, output_file, pack_tokens=args.pack_tokens)
+        create_final_policies_csv(input_csv, output_file)
+    else:
+        if args.fake_batch_dir:
+            backend = FakeBatchBackend(args.fake_batch_dir)
+        else:
+            api_key = os.getenv('OPENAI_API_KEY')
+            if not api_key:
+                print("Error: Please set your OPENAI_API_KEY environment variable")
+                exit(1)
+            backend = OpenAIBatchBackend(api_key, base_url=OPENAI_BASE_URL)
+        if args.command == "batch-submit":
+            submit_batch(input_csv, output_file, COMPLIANCE_PROMPT, backend)
+        elif args.command == "batch-poll":
+            poll_batch(output_file, backend, wait=args.wait)
+        else:
+            ingest_batch(input_csv, output_file, backend)
+            create_final_policies_csv(input_csv, output_file)
+
+    if args.metrics_file:
+        METRICS.write_summary(args.metrics_file)
+    if args.prometheus_file:
+        METRICS.write_prometheus(args.prometheus_file)
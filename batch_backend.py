@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import time
+import uuid
+import requests
+
+# a batch in one of these states will not change anymore
+FINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class OpenAIBatchBackend:
+    """Files and Batches endpoints of the OpenAI API."""
+
+    def __init__(self, api_key, base_url="https://api.openai.com/v1", session=None):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def upload(self, path):
+        """Upload a batch input JSONL file and return its file id."""
+        with open(path, 'rb') as f:
+            response = self.session.post(f"{self.base_url}/files", data={"purpose": "batch"}, files={"file": f})
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def create(self, input_file_id, endpoint="/v1/chat/completions"):
+        """Start a batch over an uploaded file and return the batch object."""
+        response = self.session.post(
+            f"{self.base_url}/batches",
+            json={"input_file_id": input_file_id, "endpoint": endpoint, "completion_window": "24h"},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def retrieve(self, batch_id):
+        response = self.session.get(f"{self.base_url}/batches/{batch_id}")
+        response.raise_for_status()
+        return response.json()
+
+    def download(self, file_id):
+        """Return the content of an output or error file as text."""
+        response = self.session.get(f"{self.base_url}/files/{file_id}/content")
+        response.raise_for_status()
+        return response.text
+
+class FakeBatchBackend:
+    """Local stand-in for OpenAIBatchBackend: batches complete at once, answered by respond(body)."""
+
+    def __init__(self, directory, respond=None):
+        self.directory = directory
+        self.respond = respond or no_violation_response
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, path):
+        file_id = f"file-{uuid.uuid4().hex}"
+        shutil.copyfile(path, self._file_path(file_id))
+        return file_id
+
+    def create(self, input_file_id, endpoint="/v1/chat/completions"):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        outputs, errors = [], []
+        with open(self._file_path(input_file_id), 'r', encoding='utf-8') as f:
+            for line in f:
+                request = json.loads(line)
+                try:
+                    content = self.respond(request["body"])
+                except Exception as e:
+                    errors.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                                   "response": None, "error": {"code": "fake_error", "message": str(e)}})
+                    continue
+                body = {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+                outputs.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                                "response": {"status_code": 200, "body": body}, "error": None})
+        batch = {
+            "id": batch_id,
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "status": "completed",
+            "created_at": int(time.time()),
+            "output_file_id": self._write_lines(outputs),
+            "error_file_id": self._write_lines(errors) if errors else None,
+            "request_counts": {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)},
+        }
+        with open(self._file_path(batch_id, ".json"), 'w', encoding='utf-8') as f:
+            json.dump(batch, f)
+        return batch
+
+    def retrieve(self, batch_id):
+        with open(self._file_path(batch_id, ".json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def download(self, file_id):
+        with open(self._file_path(file_id), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def _write_lines(self, records):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with open(self._file_path(file_id), 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return file_id
+
+    def _file_path(self, file_id, extension=".jsonl"):
+        return os.path.join(self.directory, f"{file_id}{extension}")
+
+def no_violation_response(body):
+    """Default answer of FakeBatchBackend: no policy violated."""
+    return json.dumps({
+        "policy_violated": False,
+        "policies_violated": [],
+        "violation_summary": "No policy violations detected in the conversation."
+    })
@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from r2r import R2RClient
+import Stage2
+from segment import preprocess_data, segment_by_conversation, segment_frame
+from transfer import detect_transfers
+from retrieval import DOCUMENT_ID_CC_SALES, retrieve_policies
+from Stage2 import MAIN_COLUMN_NAMES, COMPLIANCE_PROMPT, create_final_policies_csv, process_csv
+from metrics import METRICS
+from mock_servers import mock_openai, mock_r2r
+
+AGENTS = ["Sara Ahmed", "John Smith", "Mona Ali", "Omar Hassan", "Lina Saleh"]
+SKILLS = ["CC_SALES", "CC_SALES_AR", "CC_RESOLVERS", "MV_SALES"]
+BOT_LINES = [
+    "Hello :wave: how can I help you today?",
+    "Our service fee is 1,500 AED per month.",
+    "Please share your visa processing details.",
+    "I'm transferring you to one of our agents :happy:",
+]
+CONSUMER_LINES = [
+    "Hi, I want to hire a maid",
+    "How much are the fees?",
+    "My maid is sick, what should I do?",
+    "Can I talk to someone please",
+]
+AGENT_LINES = [
+    "Hi, this is {agent}, happy to help.",
+    "Let me check that for you.",
+    "The doctor visit is covered by us.",
+]
+
+def generate_export(n_conversations=1000, messages_per_conversation=12, transfer_rate=0.3, seed=0):
+    """
+    Generate a synthetic conversation export with the columns Main.main expects.
+    transfer_rate is the share of conversations where the BOT hands over to a human agent.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    start = pd.Timestamp("2025-01-01")
+    for c in range(n_conversations):
+        conv_id = f"CH{c:08x}"
+        transferred = rng.random() < transfer_rate
+        handoff = rng.integers(2, messages_per_conversation) if transferred else messages_per_conversation
+        agent = AGENTS[rng.integers(len(AGENTS))]
+        skill = SKILLS[rng.integers(len(SKILLS))]
+        for m in range(messages_per_conversation):
+            sent_time = start + pd.Timedelta(minutes=c, seconds=m)
+            if m % 2 == 0:
+                sent_by, agent_name, text = "Consumer", np.nan, CONSUMER_LINES[rng.integers(len(CONSUMER_LINES))]
+            elif m < handoff:
+                sent_by, agent_name, text = "Bot", np.nan, BOT_LINES[rng.integers(len(BOT_LINES))]
+            else:
+                sent_by, agent_name = "Agent", agent
+                text = AGENT_LINES[rng.integers(len(AGENT_LINES))].format(agent=agent)
+            message_type = "Normal Message" if rng.random() > 0.05 else "Private Message"
+            rows.append([conv_id, sent_time.isoformat(), sent_by, agent_name, skill, text, message_type])
+    return pd.DataFrame(rows, columns=["Conversation ID", "Message Sent Time", "Sent By", "Agent Name ", "Skill", "TEXT", "Message Type"])
+
+# peak memory is measured with tracemalloc, which slows Python-heavy stages down; --no-memory turns it off
+TRACE_MEMORY = True
+
+def measure(report, stage, rows, func, *args, quiet=False, **kwargs):
+    """
+    Run func, record its wall time, rows/s (over rows input rows) and peak traced memory in report,
+    and return its result. quiet hides what func prints.
+    """
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if TRACE_MEMORY else 0
+    tracemalloc.stop()
+    report.append({
+        "stage": stage,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows / seconds, 1) if seconds else None,
+        "peak_mb": round(peak / 2 ** 20, 1) if TRACE_MEMORY else None,
+    })
+    return result
+
+def bench_segmentation(df, report, loop=True):
+    """
+    Time segment_frame, and the per-conversation segment_conversation loop unless loop=False,
+    checking both produce the same rows.
+    """
+    df = df[df["Message Type"] == "Normal Message"]
+    vectorized_df = measure(report, "segment_frame", len(df), segment_frame, df)
+    if loop:
+        loop_df = measure(report, "segment_conversation", len(df), segment_by_conversation, df)
+        pd.testing.assert_frame_equal(
+            loop_df.astype(object).reset_index(drop=True),
+            vectorized_df.astype(object).reset_index(drop=True),
+        )
+        print(f"✓ {len(loop_df)} identical segments")
+    return vectorized_df
+
+def bench_transfers(segmented_df, report):
+    """Time transfer detection over the segments that contain consumer messages."""
+    segmented_df = segmented_df[segmented_df["Messages"].str.contains("Consumer:")]
+    return measure(report, "detect_transfers", len(segmented_df), detect_transfers, segmented_df)
+
+def bench_rag(transfers, report, latency, error_rate=0.0, concurrency=8):
+    """Time the R2R retrieval loop against a mock R2R server, returning the transfers with their Results."""
+    chats = transfers["Messages"].tolist()
+    with mock_r2r(latency=latency, error_rate=error_rate) as server:
+        client = R2RClient(base_url=server.url)
+        completions = measure(
+            report, "rag_loop", len(chats), retrieve_policies, client, chats, DOCUMENT_ID_CC_SALES,
+            concurrency=concurrency, backoff=0.01, quiet=True
+        )
+    return transfers.assign(Results=completions)
+
+def bench_stage2(results_df, report, work_dir, latency, error_rate=0.0, concurrency=8):
+    """Time process_csv against a mock OpenAI server, then create_final_policies_csv on its output."""
+    input_csv = os.path.join(work_dir, "r2r-results.csv")
+    output_file = os.path.join(work_dir, "r2r-results-processed.json")
+    results_df.rename(columns=MAIN_COLUMN_NAMES).to_csv(input_csv, index=False)
+    with mock_openai(latency=latency, error_rate=error_rate) as server:
+        Stage2.OPENAI_API_URL = f"{server.url}/v1/chat/completions"
+        measure(
+            report, "process_csv", len(results_df), process_csv, input_csv, output_file, COMPLIANCE_PROMPT,
+            "benchmark-key", concurrency=concurrency, quiet=True
+        )
+    measure(
+        report, "create_final_policies_csv", len(results_df), create_final_policies_csv, input_csv, output_file,
+        os.path.join(work_dir, "final_policies.csv")
+    )
+
+def print_report(report):
+    print(f"{'stage':<28}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'peak MB':>10}")
+    for entry in report:
+        peak = f"{entry['peak_mb']:.1f}" if entry["peak_mb"] is not None else "-"
+        print(f"{entry['stage']:<28}{entry['rows']:>10}{entry['seconds']:>10.3f}{entry['rows_per_second'] or 0:>12,.0f}{peak:>10}")
+
+def find_regressions(report, baseline, tolerance):
+    """Stages whose rows/s dropped, or whose peak memory grew, by more than tolerance against a baseline report."""
+    previous = {entry["stage"]: entry for entry in baseline["stages"]}
+    regressions = []
+    for entry in report:
+        before = previous.get(entry["stage"])
+        if not before:
+            continue
+        if before["rows_per_second"] and entry["rows_per_second"] < before["rows_per_second"] * (1 - tolerance):
+            regressions.append(f"{entry['stage']}: {entry['rows_per_second']:,.0f} rows/s, was {before['rows_per_second']:,.0f}")
+        if before["peak_mb"] and entry["peak_mb"] and entry["peak_mb"] > before["peak_mb"] * (1 + tolerance) + 1:
+            regressions.append(f"{entry['stage']}: peak {entry['peak_mb']} MB, was {before['peak_mb']} MB")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the conversation pipeline on a synthetic export.")
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=12)
+    parser.add_argument("--transfer-rate", type=float, default=0.3)
+    parser.add_argument("--skip-loop", action="store_true", help="don't time the per-conversation segmentation loop")
+    parser.add_argument("--r2r-latency", type=float, default=0.05, help="seconds the mock R2R server takes per request")
+    parser.add_argument("--openai-latency", type=float, default=0.1, help="seconds the mock OpenAI server takes per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock requests failing with a retryable error")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-memory", action="store_true", help="don't trace peak memory, for undistorted timings")
+    parser.add_argument("--json", help="save the report to this file")
+    parser.add_argument("--baseline", help="report saved by an earlier run, exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown / memory growth against --baseline")
+    args = parser.parse_args()
+
+    TRACE_MEMORY = not args.no_memory
+    METRICS.reset()
+    report = []
+    raw_df = generate_export(args.conversations, args.messages, args.transfer_rate)
+    df = measure(report, "preprocess_data", len(raw_df), preprocess_data, raw_df)
+    segmented_df = bench_segmentation(df, report, loop=not args.skip_loop)
+    transfers = bench_transfers(segmented_df, report)
+    results_df = bench_rag(transfers, report, args.r2r_latency, args.error_rate, args.concurrency)
+    with tempfile.TemporaryDirectory() as work_dir:
+        bench_stage2(results_df, report, work_dir, args.openai_latency, args.error_rate, args.concurrency)
+    print_report(report)
+
+    summary = METRICS.summary()
+    result = {
+        "settings": vars(args),
+        "stages": report,
+        "latency_seconds": summary["latency_seconds"],
+        "counters": summary["counters"],
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"✓ Report saved to {args.json}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"✗ {regression}")
+        if regressions:
+            sys.exit(1)
+        print("✓ No regressions against the baseline")
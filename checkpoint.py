@@ -0,0 +1,112 @@
+import json
+import os
+import textwrap
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+def occurrence_keys(ids):
+    """
+    Key every row by its id and how many earlier rows share it ("CH1#0", "CH1#1", ...),
+    so conversations with several rows are resumed row by row.
+    """
+    seen = {}
+    for id_ in ids:
+        n = seen.get(id_, 0)
+        seen[id_] = n + 1
+        yield f"{id_}#{n}"
+
+def imap_unordered(func, items, concurrency):
+    """
+    Apply func to items on a thread pool and yield (item, result) as soon as each call finishes.
+    At most 2 * concurrency items are in flight, so items can be a lazy iterator of any size.
+    """
+    concurrency = max(1, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        for item in items:
+            if len(pending) >= 2 * concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[executor.submit(func, item)] = item
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+
+class JsonlSink:
+    """
+    Append-only JSONL checkpoint of {"key", "fingerprint", "record"} lines.
+    Only lines whose fingerprint matches fingerprints[key] are indexed, so changed rows run again.
+    """
+
+    def __init__(self, path, fingerprints=None):
+        self.path = path
+        self.fingerprints = fingerprints
+        self.index = {}
+        self._file = None
+
+    def open(self):
+        self.index = {}
+        end = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entry = json.loads(line)
+                        key = entry["key"]
+                    except (ValueError, KeyError):
+                        break
+                    if self.fingerprints is None or entry.get("fingerprint") == self.fingerprints.get(key):
+                        self.index[key] = end
+                    end += len(line)
+            if os.path.getsize(self.path) > end:
+                os.truncate(self.path, end)
+        self._file = open(self.path, 'ab')
+        return self
+
+    def append(self, key, record):
+        """Write one finished result and flush it to disk."""
+        fingerprint = self.fingerprints.get(key) if self.fingerprints is not None else None
+        line = json.dumps({"key": key, "fingerprint": fingerprint, "record": record}, ensure_ascii=False) + "\n"
+        self.index[key] = self._file.tell()
+        self._file.write(line.encode('utf-8'))
+        self._file.flush()
+
+    def iter_records(self, keys):
+        """Yield the stored records for keys in the given order, skipping keys without a result."""
+        self._file.flush()
+        with open(self.path, 'rb') as f:
+            for key in keys:
+                offset = self.index.get(key)
+                if offset is None:
+                    continue
+                f.seek(offset)
+                yield json.loads(f.readline())["record"]
+
+    def remove(self):
+        """Close and delete the checkpoint once its results are compacted into the output."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_json_array(records, output_file):
+    """Stream records into a JSON array laid out like json.dump(records, f, indent=4)."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        count = 0
+        for record in records:
+            f.write("[\n" if count == 0 else ",\n")
+            f.write(textwrap.indent(json.dumps(record, indent=4, ensure_ascii=False), "    "))
+            count += 1
+        f.write("\n]" if count else "[]")
+    return count
@@ -0,0 +1,97 @@
+import re
+import zlib
+import numpy as np
+
+EMOJI_PATTERN = re.compile(r":[a-z][a-z0-9_+\-]*:|[\U0001F000-\U0001FAFF\u2600-\u27BF\uFE0F\u200D]+", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,:/\-]\d+)*")
+TOKEN_PATTERN = re.compile(r"<\w+>|\w+")
+# prime above 2**32, so (a * x + b) % MINHASH_PRIME permutes 32-bit shingle hashes without overflowing uint64
+MINHASH_PRIME = np.uint64(4294967311)
+
+def names_pattern(names):
+    """
+    Regex matching the given names (e.g. the agent names of the export) as whole words: full names in
+    any case, their single words only capitalized as in the name, so "Will" is masked but not "will".
+    """
+    full, words = set(), set()
+    for name in names:
+        if isinstance(name, str) and name.strip():
+            full.add(" ".join(name.split()))
+            words.update(word for word in name.split() if len(word) > 2)
+    if not full:
+        return None
+    alternatives = ["(?i:" + "|".join(re.escape(name) for name in sorted(full, key=len, reverse=True)) + ")"]
+    alternatives += [re.escape(word) for word in sorted(words - full, key=len, reverse=True)]
+    return re.compile(r"\b(?:" + "|".join(alternatives) + r")\b")
+
+def normalize_segment(text, names=None):
+    """
+    Tokens of a segment with emojis, numbers and the known names masked.
+    Consumer names are not known, so they are not masked.
+    """
+    text = EMOJI_PATTERN.sub(" <emoji> ", str(text))
+    text = NUMBER_PATTERN.sub("<num>", text)
+    if names is not None:
+        text = names.sub("<name>", text)
+    return TOKEN_PATTERN.findall(text.lower())
+
+def shingle_hashes(tokens, size=3):
+    """32-bit hashes of the distinct size-token shingles of a segment (a single shingle if it is shorter)."""
+    shingles = {" ".join(tokens[i:i + size]) for i in range(max(1, len(tokens) - size + 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+
+def minhash_signatures(hashes, num_perm=128, seed=0, batch_size=256):
+    """MinHash signature matrix (segments x num_perm) of the shingle hash arrays, batch_size segments at a time."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 31, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(hashes), num_perm), dtype=np.uint64)
+    for start in range(0, len(hashes), batch_size):
+        batch = hashes[start:start + batch_size]
+        offsets = np.cumsum([0] + [len(h) for h in batch[:-1]])
+        permuted = (np.concatenate(batch)[:, None] * a + b) % MINHASH_PRIME
+        signatures[start:start + len(batch)] = np.minimum.reduceat(permuted, offsets, axis=0)
+    return signatures
+
+def lsh_bands(threshold, num_perm):
+    """Number of bands (and rows per band) whose LSH similarity threshold (1/b)**(1/r) is closest to threshold."""
+    bands = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(bands, key=lambda b: abs((1 / b) ** (b / num_perm) - threshold))
+
+def cluster_segments(texts, threshold=0.9, num_perm=128, shingle_size=3, names=(), seed=0):
+    """
+    Cluster near-duplicate segments with MinHash LSH at the given Jaccard threshold.
+    Returns, for every text, the position of its cluster's representative (its first segment).
+    """
+    n = len(texts)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    pattern = names_pattern(names)
+    hashes = [shingle_hashes(normalize_segment(text, pattern), shingle_size) for text in texts]
+    signatures = minhash_signatures(hashes, num_perm=num_perm, seed=seed)
+
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    n_bands = lsh_bands(threshold, num_perm)
+    rows = num_perm // n_bands
+    for band in range(n_bands):
+        band_values = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        keys = band_values.view(np.dtype((np.void, band_values.dtype.itemsize * rows))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        leaders = first[inverse.ravel()]
+        candidates = np.flatnonzero(leaders != np.arange(n))
+        if not len(candidates):
+            continue
+        similarity = (signatures[candidates] == signatures[leaders[candidates]]).mean(axis=1)
+        for i, leader in zip(candidates[similarity >= threshold], leaders[candidates[similarity >= threshold]]):
+            root_i, root_leader = find(i), find(leader)
+            if root_i != root_leader:
+                # the smaller position stays the root, so the root is the first segment of the cluster
+                parent[max(root_i, root_leader)] = min(root_i, root_leader)
+    return np.array([find(i) for i in range(n)])
@@ -0,0 +1,108 @@
+import os
+import pickle
+import tempfile
+import pandas as pd
+
+SORT_COLUMNS = ["Conversation ID", "Message Sent Time"]
+# every export column is read as text, so chunked and whole-file reads see the same values
+EXPORT_DTYPE = str
+
+def read_export(csv_path):
+    """Read a whole conversation export with the dtypes iter_conversation_blocks uses."""
+    return pd.read_csv(csv_path, dtype=EXPORT_DTYPE)
+
+def iter_conversation_blocks(csv_path, chunksize=100_000, sorted_export=False, tmp_dir=None):
+    """
+    Yield DataFrames of complete conversations from the export, in "Conversation ID" order.
+    An unsorted export is sorted on disk first; rows without an id are dropped.
+    """
+    with pd.read_csv(csv_path, chunksize=chunksize, dtype=EXPORT_DTYPE) as reader:
+        chunks = (chunk[chunk["Conversation ID"].notna()] for chunk in reader)
+        if sorted_export:
+            yield from _split_sorted_chunks(chunks)
+        else:
+            yield from _external_sort(chunks, tmp_dir, block_rows=max(1_000, chunksize // 32))
+
+def iter_conversations(csv_path, **kwargs):
+    """Yield (conversation id, rows) for every conversation of the export, one at a time."""
+    for block in iter_conversation_blocks(csv_path, **kwargs):
+        for conv_id, conv_data in block.groupby("Conversation ID", sort=False):
+            yield conv_id, conv_data
+
+def _split_sorted_chunks(chunks):
+    carry = None
+    last_id = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        ids = chunk["Conversation ID"]
+        if not ids.is_monotonic_increasing or (last_id is not None and ids.iloc[0] < last_id):
+            raise ValueError("The export is not sorted by Conversation ID, read it with sorted_export=False")
+        last_id = ids.iloc[-1]
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        # the last conversation of a chunk may continue in the next one
+        tail = chunk["Conversation ID"] == last_id
+        carry = chunk[tail]
+        if not tail.all():
+            yield chunk[~tail]
+    if carry is not None:
+        yield carry
+
+def _external_sort(chunks, tmp_dir, block_rows):
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as spill_dir:
+        runs = []
+        for i, chunk in enumerate(chunks):
+            chunk = chunk.sort_values(SORT_COLUMNS, kind="stable")
+            path = os.path.join(spill_dir, f"run-{i}.pkl")
+            with open(path, 'wb') as f:
+                for start in range(0, len(chunk), block_rows):
+                    pickle.dump(chunk.iloc[start:start + block_rows], f, protocol=pickle.HIGHEST_PROTOCOL)
+            runs.append(path)
+        yield from _merge_runs(runs)
+
+def read_blocks(path):
+    """Yield the DataFrames pickled one after another into path."""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def _merge_runs(paths):
+    """Merge sorted runs block by block, emitting the conversations below the smallest buffered last id."""
+    runs = [read_blocks(path) for path in paths]
+    buffers = [None] * len(runs)
+    exhausted = [False] * len(runs)
+
+    def refill(i):
+        block = next(runs[i], None)
+        if block is None:
+            exhausted[i] = True
+        elif buffers[i] is None or buffers[i].empty:
+            buffers[i] = block
+        else:
+            buffers[i] = pd.concat([buffers[i], block])
+
+    for i in range(len(runs)):
+        refill(i)
+    while True:
+        open_runs = [i for i in range(len(runs)) if not exhausted[i]]
+        bound = min(buffers[i]["Conversation ID"].iloc[-1] for i in open_runs) if open_runs else None
+        ready = []
+        for i, buffer in enumerate(buffers):
+            if buffer is None or buffer.empty:
+                continue
+            cut = len(buffer) if bound is None else buffer["Conversation ID"].searchsorted(bound, side="left")
+            if cut:
+                ready.append(buffer.iloc[:cut])
+                buffers[i] = buffer.iloc[cut:]
+        if ready:
+            # runs are concatenated in file order so the stable sort keeps duplicates in file order
+            yield pd.concat(ready).sort_values(SORT_COLUMNS, kind="stable")
+        if bound is None:
+            return
+        for i in open_runs:
+            if buffers[i]["Conversation ID"].iloc[-1] == bound:
+                refill(i)
@@ -0,0 +1,79 @@
+import json
+import os
+import pandas as pd
+from export_reader import EXPORT_DTYPE, SORT_COLUMNS
+from shard import merge_shards
+
+def state_path(view_name):
+    return f"{view_name}-state.json"
+
+def load_state(path):
+    """Watermark and finished conversations of the last incremental run, empty before the first one."""
+    if not os.path.exists(path):
+        return {"watermark": None, "conversations": set()}
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    return {"watermark": state["watermark"], "conversations": set(state["conversations"])}
+
+def save_state(path, watermark, conversations):
+    """Write the state file atomically, so an interrupted run leaves the previous state in place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"watermark": watermark, "conversations": sorted(conversations)}, f)
+    os.replace(tmp_path, path)
+
+def scan_export(csv_path, state, chunksize=100_000):
+    """
+    Ids of the conversations not finished yet or with messages after the watermark, and the next watermark.
+    A late message timed at or before the watermark is missed until a full run.
+    """
+    finished = state["conversations"]
+    watermark = pd.Timestamp(state["watermark"]) if state["watermark"] else None
+    delta_ids = set()
+    latest = watermark
+    with pd.read_csv(csv_path, usecols=SORT_COLUMNS, dtype=str, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = chunk[chunk["Conversation ID"].notna()]
+            sent_time = pd.to_datetime(chunk["Message Sent Time"], errors="coerce")
+            # times not in the format inferred from the first one are parsed one by one
+            unparsed = sent_time.isna() & chunk["Message Sent Time"].notna()
+            if unparsed.any():
+                sent_time[unparsed] = pd.to_datetime(chunk.loc[unparsed, "Message Sent Time"], format="mixed", errors="coerce")
+            changed = ~chunk["Conversation ID"].isin(finished)
+            if watermark is not None:
+                changed |= sent_time > watermark
+            delta_ids.update(chunk.loc[changed, "Conversation ID"])
+            chunk_latest = sent_time.max()
+            if pd.notna(chunk_latest) and (latest is None or chunk_latest > latest):
+                latest = chunk_latest
+    return delta_ids, latest.isoformat() if latest is not None else None
+
+def write_delta_export(csv_path, ids, delta_path, chunksize=100_000):
+    """Copy the rows of the conversations in ids to delta_path, chunk by chunk. Returns the number of rows."""
+    rows = 0
+    header = True
+    with pd.read_csv(csv_path, dtype=EXPORT_DTYPE, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = chunk[chunk["Conversation ID"].isin(ids)]
+            if header or len(chunk):
+                chunk.to_csv(delta_path, index=False, mode="w" if header else "a", header=header)
+                header = False
+            rows += len(chunk)
+    return rows
+
+def clustered_on(frame, ids):
+    """Conversations with rows that share the results of a row of a conversation in ids (see Main's dedup stage)."""
+    if frame is None or "Cluster ID" not in frame.columns:
+        return set()
+    representatives = frame["Cluster ID"].astype(str).str.rsplit("#", n=1).str[0]
+    return set(frame.loc[representatives.isin(ids), "Conversation ID"].astype(str))
+
+def merge_delta(existing, delta, ids):
+    """
+    Replace the rows of the conversations in ids by the rows of delta, keeping the order a full run
+    produces (conversations sorted by id). existing is None before the first run.
+    """
+    if existing is None:
+        return merge_shards([delta])
+    kept = existing[~existing["Conversation ID"].astype(str).isin(ids)]
+    return merge_shards([kept, delta])
@@ -0,0 +1,115 @@
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # the Arrow hand-off is optional, stages fall back to CSV without pyarrow
+    pa = None
+
+# repeated values stored once per block as dictionaries, read back as pandas categoricals
+CATEGORICAL_COLUMNS = ["Conversation ID", "Last Skill", "Agent Name "]
+
+def arrow_available():
+    return pa is not None
+
+def _arrow_type(name, series):
+    """Arrow type of a column: CATEGORICAL_COLUMNS dictionary-encoded, text as strings, others as their pandas dtype."""
+    if name in CATEGORICAL_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    if series.dtype == object or isinstance(series.dtype, (pd.StringDtype, pd.CategoricalDtype)):
+        return pa.string()
+    return pa.Schema.from_pandas(series.to_frame(name), preserve_index=False).field(name).type
+
+def _to_record_batch(df, schema):
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type) or pa.types.is_string(field.type):
+            values = pa.array(df[field.name].astype("string"), type=pa.string(), from_pandas=True)
+            arrays.append(values.dictionary_encode() if pa.types.is_dictionary(field.type) else values)
+        else:
+            arrays.append(pa.array(df[field.name], type=field.type, from_pandas=True))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+class FrameSink:
+    """
+    Writes a stage's output block by block to "{basename}.arrow" and/or "{basename}.csv".
+    The Arrow schema follows the dtypes of the first block, CATEGORICAL_COLUMNS dictionary-encoded.
+    """
+
+    def __init__(self, basename, columns, arrow=True, csv=True):
+        self.basename = basename
+        self.columns = list(columns)
+        self.arrow = arrow and arrow_available()
+        self.csv = csv or not self.arrow
+        self._writer = None
+        self._csv_header = True
+        self.schema = None
+
+    def _open(self, df):
+        self.schema = pa.schema([(name, _arrow_type(name, df[name])) for name in self.columns])
+        self._writer = ipc.new_stream(f"{self.basename}.arrow", self.schema)
+
+    def write(self, df):
+        df = df[self.columns]
+        if self.arrow:
+            if self._writer is None:
+                self._open(df)
+            self._writer.write_batch(_to_record_batch(df, self.schema))
+        if self.csv:
+            df.to_csv(f"{self.basename}.csv", index=False, mode="w" if self._csv_header else "a", header=self._csv_header)
+            self._csv_header = False
+
+    def write_records(self, records, chunk_size=10_000):
+        """Write an iterable of row dicts, chunk_size rows at a time."""
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                self.write(pd.DataFrame(chunk, columns=self.columns))
+                chunk = []
+        if chunk:
+            self.write(pd.DataFrame(chunk, columns=self.columns))
+
+    def close(self):
+        if self.csv and self._csv_header:
+            pd.DataFrame(columns=self.columns).to_csv(f"{self.basename}.csv", index=False)
+        if self.arrow and self.schema is None:
+            self._open(pd.DataFrame(columns=self.columns))
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_frame(df, basename, arrow=True, csv=True):
+    """Write a whole frame with FrameSink."""
+    with FrameSink(basename, df.columns, arrow=arrow, csv=csv) as sink:
+        sink.write(df)
+
+def read_frame(basename, arrow=True):
+    """
+    Read a stage's output back: the Arrow stream through a memory map, with CATEGORICAL_COLUMNS
+    as categoricals, or the CSV when arrow is off or pyarrow is missing.
+    """
+    if not (arrow and arrow_available()):
+        return pd.read_csv(f"{basename}.csv")
+    with pa.memory_map(f"{basename}.arrow") as source:
+        return ipc.open_stream(source).read_all().unify_dictionaries().to_pandas()
+
+def frame_exists(basename, arrow=True):
+    """Whether read_frame(basename, arrow) has a file to read."""
+    return os.path.exists(f"{basename}.arrow" if arrow and arrow_available() else f"{basename}.csv")
+
+def iter_rows(path):
+    """Yield the rows of an Arrow stream as dicts, one record batch at a time."""
+    with pa.memory_map(path) as source:
+        for batch in ipc.open_stream(source):
+            yield from batch.to_pylist()
+
+def is_arrow_path(path):
+    return os.path.splitext(path)[1] == ".arrow"
@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import numpy as np
+from r2r import R2RException
+
+try:
+    from scipy import sparse
+except ImportError:  # the local index is optional, it needs scipy
+    sparse = None
+
+DEFAULT_SNAPSHOT_DIR = "policy_snapshots"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def local_index_available():
+    return sparse is not None
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+def document_version(client, document_id):
+    """Version tag of an R2R document; it changes whenever the document is re-ingested."""
+    document = client.documents.retrieve(id=document_id).results
+    return f"{document.version}:{document.updated_at}:{document.size_in_bytes}"
+
+def fetch_chunks(client, document_id, include_vectors=False, page_size=100):
+    """Page through every chunk of an R2R document."""
+    chunks = []
+    while True:
+        page = client.documents.list_chunks(id=document_id, include_vectors=include_vectors, offset=len(chunks), limit=page_size)
+        for chunk in page.results:
+            chunks.append({"id": str(chunk.id), "text": chunk.text, "metadata": chunk.metadata, "vector": chunk.vector})
+        if not page.results or len(chunks) >= page.total_entries:
+            return chunks
+
+def load_snapshot(client, document_id, directory=DEFAULT_SNAPSHOT_DIR, include_vectors=False):
+    """(chunks, vectors) of a document from its local snapshot, pulled from R2R again when the document changed."""
+    path = os.path.join(directory, f"{document_id}.json")
+    vectors_path = os.path.join(directory, f"{document_id}.npy")
+    snapshot = None
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+
+    version = None
+    if client is not None:
+        try:
+            version = document_version(client, document_id)
+        except R2RException as e:
+            if snapshot is None:
+                raise
+            print(f"✗ Could not check the version of document {document_id} ({e}), using the local snapshot")
+    elif snapshot is None:
+        raise FileNotFoundError(f"No local snapshot of document {document_id} in {directory}")
+
+    if snapshot is None or (version is not None and snapshot["version"] != version):
+        chunks = fetch_chunks(client, document_id, include_vectors=include_vectors)
+        os.makedirs(directory, exist_ok=True)
+        vectors = [chunk.pop("vector") for chunk in chunks]
+        if include_vectors and chunks and all(vector is not None for vector in vectors):
+            np.save(vectors_path, np.asarray(vectors, dtype=np.float32))
+        elif os.path.exists(vectors_path):
+            os.remove(vectors_path)
+        snapshot = {"document_id": document_id, "version": version, "chunks": chunks}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        print(f"✓ Saved a snapshot of {len(chunks)} chunks of document {document_id}")
+
+    vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+    return snapshot["chunks"], vectors
+
+class PolicyIndex:
+    """
+    In-process BM25 retrieval over the policy chunks, blended with cosine similarity when vectors are given.
+    Scores are absolute, in [0, 1].
+    """
+
+    def __init__(self, chunks, vectors=None, embed=None, k1=1.5, b=0.75):
+        if sparse is None:
+            raise ImportError("The local policy index needs scipy")
+        self.chunks = chunks
+        self.embed = embed
+        self.vocabulary = {}
+        rows, cols = [], []
+        for row, chunk in enumerate(chunks):
+            for token in tokenize(chunk["text"]):
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+        tf = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(chunks), len(self.vocabulary)))
+        tf.sum_duplicates()
+        lengths = np.asarray(tf.sum(axis=1)).ravel()
+        df = np.bincount(tf.indices, minlength=len(self.vocabulary))
+        idf = np.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+        row_lengths = np.repeat(lengths, np.diff(tf.indptr))
+        norm = k1 * (1 - b + b * row_lengths / max(lengths.mean(), 1))
+        weights = idf[tf.indices] * tf.data * (k1 + 1) / (tf.data + norm)
+        self.weights = sparse.csr_matrix((weights, tf.indices, tf.indptr), shape=tf.shape).T.tocsr()
+        # highest weight of every term in any chunk, the sum over a query's terms bounds its BM25 score
+        self.max_weights = self.weights.max(axis=1).toarray().ravel()
+        # score of a query containing every term of the chunk
+        self.chunk_weights = np.asarray(self.weights.sum(axis=0)).ravel()
+        self.vectors = None
+        if vectors is not None and embed is not None:
+            self.vectors = np.array(vectors, dtype=np.float32)
+            self.vectors /= np.linalg.norm(self.vectors, axis=1, keepdims=True) + 1e-12
+
+    def scores(self, queries):
+        """Score matrix of shape (queries, chunks), scores between 0 and 1."""
+        rows, cols = [], []
+        for row, query in enumerate(queries):
+            for term in set(tokenize(query)):
+                col = self.vocabulary.get(term)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        query_matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(queries), len(self.vocabulary)))
+        scores = (query_matrix @ self.weights).toarray()
+        bound = (query_matrix @ self.max_weights)[:, None] * self.chunk_weights[None, :]
+        scores = np.divide(scores, np.sqrt(bound), out=np.zeros_like(scores), where=bound > 0)
+        if self.vectors is not None:
+            # blend with cosine similarity of the embeddings, floored at 0 to stay in [0, 1]
+            embedded = np.asarray(self.embed(list(queries)), dtype=np.float32)
+            embedded /= np.linalg.norm(embedded, axis=1, keepdims=True) + 1e-12
+            scores = 0.5 * scores + 0.5 * np.clip(embedded @ self.vectors.T, 0, None)
+        return scores
+
+    def search(self, queries, limit=20, min_score=0.0):
+        """
+        The best `limit` chunks of every query scoring above min_score, as lists of (chunk index, score)
+        by decreasing score.
+        """
+        scores = self.scores(queries)
+        limit = min(limit, scores.shape[1])
+        if limit == 0:
+            return [[] for _ in queries]
+        top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+        top = np.take_along_axis(top, order, axis=1)
+        return [[(int(i), float(scores[q, i])) for i in row if scores[q, i] > min_score] for q, row in enumerate(top)]
+
+    def policies_json(self, matches):
+        """Render matches like the R2R completion Stage2 reads, with the score as relevance_score."""
+        policies = []
+        for i, score in matches:
+            text = self.chunks[i]["text"].strip()
+            metadata = self.chunks[i].get("metadata") or {}
+            policies.append({
+                "title": metadata.get("title") or text.split("\n", 1)[0][:120],
+                "relevance_score": round(score, 2),
+                "excerpt": text,
+                "exceptions": "",
+            })
+        return json.dumps({"policies": policies}, ensure_ascii=False)
+
+def iter_local_policies(index, chats, limit=20, batch_size=1024, min_score=0.0):
+    """
+    Like retrieval.iter_policies, but answered by a PolicyIndex batch_size chats at a time.
+    Chunks scoring min_score or less are left out, as R2R leaves out policies it finds irrelevant.
+    """
+    for start in range(0, len(chats), batch_size):
+        batch = chats[start:start + batch_size]
+        for offset, matches in enumerate(index.search(batch, limit=limit, min_score=min_score)):
+            yield start + offset, index.policies_json(matches)
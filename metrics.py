@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds in seconds of the latency histogram buckets, as in a Prometheus histogram
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf"))
+
+class Histogram:
+    """Latency histogram with fixed buckets, plus count, sum and max."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated inside its bucket like Prometheus' histogram_quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return round(lower + (upper - lower) * (rank - seen) / count, 3)
+            seen += count
+            lower = bound
+        return round(self.max, 3)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else None,
+            "max": round(self.max, 3),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+class Stage:
+    """Wall time and rows of one pipeline stage, see Metrics.stage."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows = 0
+
+class Metrics:
+    """
+    Thread-safe registry of stage timings, latency histograms and counters for one run.
+    Counters and histograms take labels as keyword arguments, e.g. increment("retries_total", service="r2r").
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stages = {}
+            self.histograms = {}
+            self.counters = {}
+
+    def stage(self, name):
+        """Context manager timing a stage; set .rows on the returned Stage to the number of rows it handled."""
+        return _StageTimer(self, name)
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def increment(self, name, value=1, **labels):
+        with self.lock:
+            key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self):
+        """The run so far as a JSON-serializable dict."""
+        with self.lock:
+            return {
+                "wall_seconds": round(time.time() - self.started, 3),
+                "stages": {
+                    name: {
+                        "seconds": round(stage.seconds, 3),
+                        "rows": stage.rows,
+                        "rows_per_second": round(stage.rows / stage.seconds, 1) if stage.seconds else None,
+                    }
+                    for name, stage in self.stages.items()
+                },
+                "latency_seconds": {_label_name(name, labels): h.summary() for (name, labels), h in self.histograms.items()},
+                "counters": {_label_name(name, labels): value for (name, labels), value in self.counters.items()},
+            }
+
+    def write_summary(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        print(f"✓ Metrics summary saved to {path}")
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format, names prefixed with "compliance_"."""
+        lines = []
+        with self.lock:
+            for name, stage in self.stages.items():
+                lines.append(f'compliance_stage_seconds{{stage="{name}"}} {stage.seconds}')
+                lines.append(f'compliance_stage_rows{{stage="{name}"}} {stage.rows}')
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"compliance_{name}{_prometheus_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(f"compliance_{name}_bucket{_prometheus_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"compliance_{name}_sum{_prometheus_labels(labels)} {histogram.sum}")
+                lines.append(f"compliance_{name}_count{_prometheus_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics for the node_exporter textfile collector, atomically so it never reads a partial file."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def serve_prometheus(self, port, host="0.0.0.0"):
+        """Serve the metrics as text on http://host:port/metrics from a background thread; returns the server."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+class _StageTimer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.stage = Stage()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, *exc):
+        self.stage.seconds = time.perf_counter() - self.start
+        with self.metrics.lock:
+            self.metrics.stages[self.name] = self.stage
+
+def _label_name(name, labels):
+    return name + "".join(f"[{key}={value}]" for key, value in labels)
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+# registry of the current process, shared by Main, Stage2 and the pipeline runner
+METRICS = Metrics()
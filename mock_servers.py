@@ -0,0 +1,122 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from packing import estimate_tokens
+
+POLICY_TITLES = [
+    "Service Fees & Payment Terms",
+    "Redirecting to Medical Facilities & Providing Links",
+    "Visa Processing Timelines",
+    "Maid Replacement Policy",
+    "Escalating to a Human Agent",
+    "Refund Eligibility",
+]
+
+class MockServer:
+    """
+    Local HTTP server answering every POST with respond(path, body) -> (status, payload[, headers]).
+    A share error_rate of the requests fails with error_status; clients records the connections.
+    """
+
+    def __init__(self, respond, latency=0.05, jitter=0.0, error_rate=0.0, error_status=503, seed=0):
+        self.respond = respond
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.clients = set()
+        self.server = None
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock.lock:
+                    mock.requests += 1
+                    delay = mock.latency + mock.random.uniform(0, mock.jitter)
+                    failed = mock.random.random() < mock.error_rate
+                    mock.errors += failed
+                    mock.clients.add(self.client_address)
+                time.sleep(delay)
+                headers = {"Retry-After": "0"} if failed else {}
+                if failed:
+                    status, payload = mock.error_status, {"detail": "mock server busy"}
+                else:
+                    status, payload, *extra = mock.respond(self.path, body)
+                    headers = extra[0] if extra else {}
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _digest(text):
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+
+def r2r_rag_response(path, body):
+    """retrieval.rag answer: a policies JSON completion picked deterministically from the query."""
+    digest = _digest(body.get("query", ""))
+    policies = [
+        {
+            "title": POLICY_TITLES[(digest + i) % len(POLICY_TITLES)],
+            "relevance_score": round(0.99 - 0.07 * i, 2),
+            "excerpt": "Mock policy excerpt.",
+            "exceptions": "",
+        }
+        for i in range(1 + digest % 3)
+    ]
+    completion = json.dumps({"policies": policies})
+    return 200, {"results": {"generated_answer": completion, "completion": completion, "search_results": {}}}
+
+def openai_chat_response(path, body):
+    """Chat completion answer: an evaluation in the compliance JSON format, with a usage block."""
+    prompt = "".join(message["content"] for message in body.get("messages", []))
+    violated = _digest(prompt) % 5 == 0
+    content = json.dumps({
+        "policy_violated": violated,
+        "policies_violated": [{"title": POLICY_TITLES[0], "description": "Mock violation."}] if violated else [],
+        "violation_summary": "Mock violation." if violated else "No policy violations detected in the conversation.",
+    })
+    usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(content)}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return 200, {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}], "usage": usage}
+
+def mock_r2r(latency=0.2, jitter=0.0, error_rate=0.0, seed=0):
+    return MockServer(r2r_rag_response, latency=latency, jitter=jitter, error_rate=error_rate, error_status=503, seed=seed)
+
+def mock_openai(latency=1.0, jitter=0.0, error_rate=0.0, seed=0):
+    return MockServer(openai_chat_response, latency=latency, jitter=jitter, error_rate=error_rate, error_status=429, seed=seed)
@@ -0,0 +1,120 @@
+import json
+import re
+
+# appended to the compliance prompt when several conversations share one request
+PACKED_INSTRUCTIONS = """
+    ### Multiple Conversations:
+    The input holds several conversations under `conversations`, each keyed by its conversation key and listing the ids and relevance scores of the policies that apply to it. The policies themselves are given once under `policies`, keyed by id.
+    Evaluate every conversation on its own, only against its own policies, exactly as described above.
+    Respond with a single JSON object whose `results` maps every conversation key to its evaluation in the JSON format described above:
+    {
+    "results": {
+        "<conversation_key>": {
+        "policy_violated": <true/false>,
+        "policies_violated": [...],
+        "violation_summary": "<summary_of_violation>"
+        },
+        ...
+    }
+    }
+    """
+
+def estimate_tokens(text):
+    """Rough token count of text (about 4 characters per token), enough to keep requests under a budget."""
+    return len(text) // 4 + 1
+
+def policy_units(policies_data):
+    """Split a policies payload into separately shareable policies: the entries of its "policies" list, or the whole payload."""
+    entries = policies_data.get("policies") if isinstance(policies_data, dict) else None
+    if isinstance(entries, list) and entries and all(isinstance(entry, dict) for entry in entries):
+        return entries
+    return [policies_data]
+
+class PackItem:
+    """One row to evaluate, with its policies reduced to canonical JSON so identical policies can be shared."""
+
+    def __init__(self, key, row, messages, policies_data):
+        self.key = key
+        self.row = row
+        self.messages = messages
+        self.policies_data = policies_data
+        self.refs = []
+        self.unit_tokens = {}
+        if policies_data:
+            for policy in policy_units(policies_data):
+                relevance = policy.get("relevance_score") if isinstance(policy, dict) else None
+                body = {k: v for k, v in policy.items() if k != "relevance_score"} if isinstance(policy, dict) else policy
+                unit = json.dumps(body, sort_keys=True, ensure_ascii=False)
+                self.refs.append((unit, relevance))
+                self.unit_tokens[unit] = estimate_tokens(unit)
+        self.message_tokens = estimate_tokens(str(messages))
+
+    @property
+    def packable(self):
+        return bool(self.refs)
+
+def pack_items(items, budget, base_tokens, max_items=8, window=64):
+    """Group items sharing policies into packs of at most max_items rows and about budget prompt tokens."""
+    buffer = []
+    for item in items:
+        if not item.packable:
+            yield [item]
+            continue
+        buffer.append(item)
+        if len(buffer) >= window:
+            yield from _pack_window(buffer, budget, base_tokens, max_items)
+            buffer = []
+    if buffer:
+        yield from _pack_window(buffer, budget, base_tokens, max_items)
+
+def _pack_window(items, budget, base_tokens, max_items):
+    remaining = list(items)
+    while remaining:
+        first = remaining.pop(0)
+        pack = [first]
+        units = set(first.unit_tokens)
+        tokens = base_tokens + first.message_tokens + sum(first.unit_tokens.values())
+        while len(pack) < max_items:
+            best, best_overlap, best_extra = None, -1.0, 0
+            for i, item in enumerate(remaining):
+                extra = item.message_tokens + sum(t for unit, t in item.unit_tokens.items() if unit not in units)
+                if tokens + extra > budget:
+                    continue
+                overlap = len(units.intersection(item.unit_tokens)) / len(item.unit_tokens)
+                if overlap > best_overlap:
+                    best, best_overlap, best_extra = i, overlap, extra
+            if best is None:
+                break
+            item = remaining.pop(best)
+            pack.append(item)
+            units.update(item.unit_tokens)
+            tokens += best_extra
+        yield pack
+
+def packed_payload(pack):
+    """User message of a packed request: every distinct policy once, then each conversation with its policy ids."""
+    ids = {}
+    conversations = {}
+    for item in pack:
+        refs = []
+        for unit, relevance in item.refs:
+            policy_id = ids.setdefault(unit, f"P{len(ids) + 1}")
+            refs.append({"id": policy_id, "relevance_score": relevance} if relevance is not None else {"id": policy_id})
+        conversations[item.key] = {"messages": item.messages, "policies": refs}
+    policies = {policy_id: json.loads(unit) for unit, policy_id in ids.items()}
+    return json.dumps({"policies": policies, "conversations": conversations}, indent=2, ensure_ascii=False)
+
+def parse_packed_output(answer, keys):
+    """
+    Map every key to its evaluation from a packed answer, or return None when the answer is not
+    usable (not JSON, or a key is missing) so the caller can fall back to one request per row.
+    """
+    cleaned = re.sub(r'^```(json)?', '', answer.strip(), flags=re.IGNORECASE)
+    cleaned = re.sub(r'```$', '', cleaned).strip()
+    try:
+        results = json.loads(cleaned).get("results")
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(results, dict) or not all(isinstance(results.get(key), dict) for key in keys):
+        return None
+    return {key: results[key] for key in keys}
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import json
+import os
+import queue
+import threading
+from r2r import R2RClient
+from segment import SEGMENT_COLUMNS, segment_export
+from export_reader import iter_conversation_blocks
+from transfer import detect_transfers
+from retrieval import DOCUMENT_ID_CC_SALES, TokenBucket, rag_with_retries
+from cache import DEFAULT_CACHE_PATH, ResponseCache
+from checkpoint import imap_unordered
+from intermediate import FrameSink
+from metrics import METRICS
+from result_store import ResultRecord
+from Stage2 import (MAIN_COLUMN_NAMES, COMPLIANCE_PROMPT, FINAL_COLUMNS, call_openai_api, create_session, final_row,
+                    process_row)
+
+TRANSFER_COLUMNS = ["Conversation ID", "Last Skill", "Agent Name ", "Messages"]
+RESULT_COLUMNS = TRANSFER_COLUMNS + ["Results"]
+_DONE = object()
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+def _feed(items, out_queue):
+    """Put every item of a generator on a bounded queue (blocking while it is full), then an end marker."""
+    try:
+        for item in items:
+            out_queue.put(item)
+    except Exception as e:
+        out_queue.put(_StageError(e))
+    out_queue.put(_DONE)
+
+def _drain(in_queue):
+    """Yield the items put on a queue by _feed, re-raising a failure of the feeding stage."""
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.error
+        yield item
+
+def start_stage(items, maxsize):
+    """Run a generator on its own thread and return an iterator over its items, at most maxsize of them buffered."""
+    out_queue = queue.Queue(maxsize=maxsize)
+    threading.Thread(target=_feed, args=(items, out_queue), daemon=True).start()
+    return _drain(out_queue)
+
+def iter_transfers(csv_path, chunksize, sorted_export, vectorized, segmented_sink=None, transfers_sink=None):
+    """Segment the export block by block and yield its transfer rows, every block holds complete conversations."""
+    for block in iter_conversation_blocks(csv_path, chunksize=chunksize, sorted_export=sorted_export):
+        segmented_df = segment_export(block, vectorized)
+        transfers = detect_transfers(segmented_df, max_messages=3)
+        if segmented_sink:
+            segmented_sink.write(segmented_df)
+        if transfers_sink:
+            transfers_sink.write(transfers)
+        METRICS.increment("rows_total", len(transfers), stage="transfers")
+        yield from transfers[TRANSFER_COLUMNS].to_dict("records")
+
+def run_pipeline(view_name="Sales CC", r2r_url="http://localhost:7272", chunksize=10_000, sorted_export=True,
+                 vectorized=True, rag_concurrency=8, rate_limit=None, concurrency=8, queue_size=256,
+                 cache_path=DEFAULT_CACHE_PATH, bypass_cache=False, final_csv_path="final_policies.csv", stage_files=False,
+                 metrics_file=None, prometheus_file=None):
+    """
+    Run Main and Stage2 as one streaming pipeline, writing every evaluated row to final_csv_path at once.
+    An unsorted export needs sorted_export=False, which sorts it on disk before the first row comes out.
+    """
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        print("Error: Please set your OPENAI_API_KEY environment variable")
+        exit(1)
+
+    client = R2RClient(base_url=r2r_url)
+    cache = ResponseCache(cache_path, bypass=bypass_cache) if cache_path else None
+    limiter = TokenBucket(rate_limit) if rate_limit else None
+    sinks = []
+    if stage_files:
+        sinks = [
+            FrameSink(f"{view_name}-segmented_conversations", SEGMENT_COLUMNS),
+            FrameSink(f"{view_name}-transfered_with_messages", TRANSFER_COLUMNS),
+            FrameSink(f"{view_name}-r2r-results", RESULT_COLUMNS),
+        ]
+    segmented_sink, transfers_sink, results_sink = sinks or (None, None, None)
+
+    def retrieve(row):
+        return rag_with_retries(client, row["Messages"], DOCUMENT_ID_CC_SALES, limiter=limiter, cache=cache)
+
+    def retrieved(rows):
+        buffered = []
+        for row, completion in imap_unordered(retrieve, rows, rag_concurrency):
+            row = {**row, "Results": completion}
+            METRICS.increment("rows_total", stage="retrieval")
+            if results_sink:
+                buffered.append(row)
+                if len(buffered) >= 1_000:
+                    results_sink.write_records(buffered)
+                    buffered = []
+            yield {MAIN_COLUMN_NAMES.get(name, name): value for name, value in row.items()}
+        if buffered:
+            results_sink.write_records(buffered)
+
+    try:
+        transfers = start_stage(
+            iter_transfers(f"{view_name}.csv", chunksize, sorted_export, vectorized, segmented_sink, transfers_sink),
+            queue_size
+        )
+        results = start_stage(retrieved(transfers), queue_size)
+        with METRICS.stage("pipeline") as stage, create_session(pool_size=max(1, concurrency)) as session, \
+                open(final_csv_path, 'w', newline='', encoding='utf-8') as outfile:
+            def evaluate(messages, policies_data):
+                return call_openai_api(messages, policies_data, COMPLIANCE_PROMPT, api_key, session=session, cache=cache)
+
+            writer = csv.DictWriter(outfile, fieldnames=FINAL_COLUMNS)
+            writer.writeheader()
+            # the Policies field of every row is parsed once, for the evaluation and the final row
+            records = ((row, ResultRecord.from_row(row)) for row in results)
+            evaluated = imap_unordered(lambda item: process_row(item[0], evaluate, item[1]), records, concurrency)
+            for (_, record), result in evaluated:
+                record.output = result["output"]
+                writer.writerow(final_row(record))
+                outfile.flush()
+                stage.rows += 1
+    finally:
+        for sink in sinks:
+            sink.close()
+        if cache:
+            print(f"✓ Cache: {json.dumps(cache.stats())}")
+            cache.close()
+    print(f"✓ {stage.rows} rows written to {final_csv_path}")
+    if metrics_file:
+        METRICS.write_summary(metrics_file)
+    if prometheus_file:
+        METRICS.write_prometheus(prometheus_file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run Main and Stage2 as one streaming pipeline.")
+    parser.add_argument("--view", default="Sales CC", help="export to read, as {view}.csv")
+    parser.add_argument("--unsorted-export", action="store_true",
+                        help="accept an export not sorted by Conversation ID; it is sorted on disk first, so the first "
+                             "rows are only written after a full pass over it")
+    parser.add_argument("--output", default="final_policies.csv")
+    parser.add_argument("--metrics-file", help="save the JSON run summary to this file")
+    args = parser.parse_args()
+    run_pipeline(args.view, sorted_export=not args.unsorted_export, final_csv_path=args.output, metrics_file=args.metrics_file)
@@ -0,0 +1,153 @@
+import json
+import os
+from collections import deque
+from checkpoint import write_json_array
+
+HIGH_RELEVANCE_THRESHOLD = 0.9
+_DECODER = json.JSONDecoder()
+
+def decode_first_object(text):
+    """
+    The first JSON object in text, whatever surrounds it (markdown code fences, prose, a second object),
+    or None. Each candidate "{" is decoded with raw_decode, so the object ends where its JSON ends.
+    """
+    if not text:
+        return None
+    start = text.find("{")
+    while start != -1:
+        try:
+            value, _ = _DECODER.raw_decode(text, start)
+            if isinstance(value, dict):
+                return value
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+def iter_json_array(path, chunk_size=1 << 16):
+    """Yield the elements of the JSON array in path one at a time, reading chunk_size characters at a time."""
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        pos = 0
+        eof = False
+        started = False
+
+        def refill():
+            nonlocal buffer, pos, eof
+            more = f.read(chunk_size)
+            eof = not more
+            buffer = buffer[pos:] + more
+            pos = 0
+
+        while True:
+            # skip whitespace and separators up to the next element
+            while pos < len(buffer) and buffer[pos] in " \t\r\n" + ("," if started else ""):
+                pos += 1
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError(f"{path} ends before its JSON array does")
+                refill()
+                continue
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{path} does not hold a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                value, end = _DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                refill()
+                continue
+            # a value is complete once a separator follows it, a number may go on in the next chunk
+            after = end
+            while after < len(buffer) and buffer[after] in " \t\r\n":
+                after += 1
+            if after == len(buffer) or buffer[after] not in ",]":
+                if eof:
+                    raise ValueError(f"{path} is not a valid JSON array")
+                refill()
+                continue
+            yield value
+            pos = end
+
+def records_path(output_file):
+    """Result store kept next to a processed output file: one parsed result entry per row, as JSONL."""
+    return os.path.splitext(output_file)[0] + ".records.jsonl"
+
+def write_results(entries, output_file):
+    """Write result entries to output_file, without policies_data, and to its result store. Returns their number."""
+    with open(records_path(output_file), 'w', encoding='utf-8') as store:
+        def processed():
+            for entry in entries:
+                store.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                yield {name: value for name, value in entry.items() if name != "policies_data"}
+        return write_json_array(processed(), output_file)
+
+def iter_stored_results(output_file):
+    """
+    Yield the result entries of a processed output file one at a time: from its result store, or from
+    the file itself when it was written without one (those entries have no parsed policies).
+    """
+    path = records_path(output_file)
+    if not os.path.exists(path):
+        yield from iter_json_array(output_file)
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+class ResultRecord:
+    """
+    One row of the r2r results with its payloads parsed once: the policies JSON of the row (None when
+    it has none) and the evaluation output. The final CSV and the relevance filter read these fields directly.
+    """
+
+    def __init__(self, conversation_id, messages, policies_data, output=None):
+        self.conversation_id = conversation_id
+        self.messages = messages
+        self.policies_data = policies_data
+        self.output = output
+        # same rules as the original report: a "policies" list of objects with numeric relevance scores,
+        # anything else counts as no policies
+        try:
+            self.policies = list(policies_data.get("policies", [])) if policies_data is not None else None
+            self.high_relevance_titles = [
+                p.get("title", "") for p in self.policies or [] if p.get("relevance_score", 0) > HIGH_RELEVANCE_THRESHOLD
+            ]
+        except (AttributeError, TypeError):
+            self.policies = None
+            self.high_relevance_titles = []
+
+    @classmethod
+    def from_row(cls, row, output=None):
+        """Build a record from a row of the r2r results (Stage2 column names), parsing its Policies field."""
+        return cls(row.get("Conversation Id"), row.get("Messages", ""), decode_first_object(row.get("Policies", "")), output)
+
+def iter_result_records(rows, entries):
+    """
+    Join the r2r results rows with the processed entries into ResultRecords, in input order.
+    The n-th row of a conversation gets its n-th entry.
+    """
+    entries = iter(entries)
+    read_ahead = {}
+    exhausted = False
+    for row in rows:
+        conversation_id = row.get("Conversation Id")
+        queue = read_ahead.get(conversation_id)
+        while not queue and not exhausted:
+            entry = next(entries, None)
+            if entry is None:
+                exhausted = True
+                break
+            read_ahead.setdefault(entry.get("conversation_id"), deque()).append(entry)
+            queue = read_ahead.get(conversation_id)
+        entry = queue.popleft() if queue else None
+        if entry is not None and "policies_data" in entry:
+            yield ResultRecord(conversation_id, row.get("Messages", ""), entry["policies_data"], entry.get("output", {}))
+        else:
+            yield ResultRecord.from_row(row, entry.get("output", {}) if entry is not None else None)
@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from r2r import R2RClientException, R2RException
+from cache import cache_key, normalize_text
+from checkpoint import imap_unordered
+from metrics import METRICS
+
+DOCUMENT_ID_CC_SALES="d25939ce-cae7-5636-9f04-4345f7f9c088"
+
+# run r2r on every transferred conversation with this prompt
+RAG_PROMPT = """
+Based on the ingested document, return a JSON object summarizing all relevant policies, instructions, or rules that apply to this conversation.
+
+Guidelines:
+•⁠  ⁠*Customer Intent Matching:* Whether the policy addresses the customer's specific inquiry, complaint, or issue.
+•⁠  ⁠*Keyword Overlap:* Presence of relevant terms (sickness, pain, hospitals, symptoms, doctor, visa processing, service fees, salaries, etc.).
+•⁠  ⁠*Bot Response Appropriateness:* How well the policy supports or validates the customer service responses provided.
+•⁠  ⁠*Communication Style:* Policy alignment with professional WhatsApp standards, including the use of emojis (indicated by ⁠ :: ⁠ like ⁠ :happy: ⁠), jargon, or informal language.
+•⁠  ⁠*Process Relevance:* How well the policy covers relevant processes mentioned in the conversation.
+•⁠  ⁠*Exclusion Criterion*: If the policy is primarily about the procedures for filing complaints or making a chat transfer, assign a relevance score of 0.00.
+•⁠  ⁠If no policies are relevant, return a JSON object containing an empty list.
+# Output Requirements and schema:
+For each selected policy:
+•⁠  ⁠Title: Use the policy's official title.
+•⁠  ⁠Relevance Score: The calculated score (float between 0.00 and 1.0, 1.0 being the highest).
+•⁠  ⁠Excerpt: Extract the most relevant portion explaining the core policy rule or guideline.
+•⁠  ⁠Exceptions: If the policy has exceptions or special cases, include them in the output.
+
+Respond ONLY with a valid JSON object. Do not include any other text, explanation, or example.
+
+Here is the input conversation. Apply the above instructions accordingly. Do not include references.
+{chat}
+"""
+
+# status codes worth retrying: timeouts, rate limiting and server-side failures
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+def build_search_settings(document_id):
+    """Search settings used for every retrieval, restricted to a single document."""
+    return {
+        "search_strategy": "rag_fusion",
+        "limit": 20,
+        "search_mode": "advanced",
+        "filter":{
+            "document_id": document_id
+        }
+    }
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` calls per second, with bursts of up to `capacity` calls."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def is_transient(error):
+    """Connection failures and retryable status codes are transient, anything else is final."""
+    if isinstance(error, R2RClientException):
+        return True
+    return isinstance(error, R2RException) and error.status_code in TRANSIENT_STATUS_CODES
+
+def rag_cache_key(chat, document_id):
+    """Cache key of a retrieval: the normalized chat, prompt template, document and search settings."""
+    return cache_key("r2r.rag", normalize_text(chat), RAG_PROMPT, document_id, build_search_settings(document_id))
+
+def rag_with_retries(client, chat, document_id, max_retries=4, backoff=0.5, limiter=None, cache=None):
+    """Run the RAG prompt for one conversation and return the completion, retrying transient errors."""
+    if cache:
+        key = rag_cache_key(chat, document_id)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    prompt = RAG_PROMPT.format(chat=chat)
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = client.retrieval.rag(
+                query=prompt,
+                search_settings=build_search_settings(document_id)
+            )
+            METRICS.observe("r2r_rag_seconds", time.perf_counter() - start)
+            completion = response.results.completion
+            if cache and completion is not None:
+                cache.set(key, completion)
+            return completion
+        except R2RException as e:
+            METRICS.observe("r2r_rag_seconds", time.perf_counter() - start)
+            if attempt == max_retries or not is_transient(e):
+                METRICS.increment("errors_total", service="r2r", status=e.status_code)
+                raise
+            METRICS.increment("retries_total", service="r2r", status=e.status_code)
+            delay = backoff * 2 ** attempt + random.uniform(0, backoff)
+            print(f"✗ R2R request failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def iter_policies(client, chats, document_id, concurrency=8, rate_limit=None, max_retries=4, backoff=0.5, cache=None):
+    """Yield (position, completion) for every chat as it finishes, with up to concurrency requests in flight."""
+    limiter = TokenBucket(rate_limit) if rate_limit else None
+
+    def retrieve(item):
+        position, chat = item
+        return rag_with_retries(client, chat, document_id, max_retries=max_retries, backoff=backoff, limiter=limiter, cache=cache)
+
+    for (position, _), completion in imap_unordered(retrieve, enumerate(chats), concurrency):
+        yield position, completion
+
+def retrieve_policies(client, chats, document_id, **kwargs):
+    """Like iter_policies, but returns all completions in input order."""
+    completions = [None] * len(chats)
+    for position, completion in iter_policies(client, chats, document_id, **kwargs):
+        completions[position] = completion
+    return completions
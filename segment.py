@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def segment_conversation(conv_data):
@@ -37,3 +38,90 @@ def segment_conversation(conv_data):
     return segments
 
 
+SEGMENT_COLUMNS = ["Conversation ID", "Last Skill", "Agent Name ", "Messages"]
+
+def segment_by_conversation(df):
+    """Runs segment_conversation on every conversation in df and returns the segments as a DataFrame."""
+    all_segments = []
+    for conv_id, conv_data in df.groupby("Conversation ID"):
+        for agent, last_skill, segment_messages in segment_conversation(conv_data):
+            all_segments.append([conv_id, last_skill, agent, "\n".join(segment_messages)])
+    return pd.DataFrame(all_segments, columns=SEGMENT_COLUMNS)
+
+def _as_str(series):
+    """Stringify a column the way str() does, including missing values as 'nan'."""
+    return series.astype(str).fillna("nan")
+
+def segment_frame(df):
+    """
+    Segments every conversation in df at once, like segment_conversation on each group.
+    Returns one row per segment with the columns in SEGMENT_COLUMNS.
+    """
+    # groupby drops missing keys and orders conversations, keep the same rows and order
+    df = df[df["Conversation ID"].notna()].sort_values("Conversation ID", kind="stable")
+    n = len(df)
+    if n == 0:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS)
+
+    conv = df["Conversation ID"].to_numpy()
+    sender = _as_str(df["Sent By"]).str.strip().str.lower()
+    sender_values = sender.to_numpy(dtype=object)
+    is_actor = np.isin(sender_values, ["agent", "bot"])
+    identity = np.where(sender_values == "agent", df["Agent Name "].to_numpy(dtype=object), "BOT")
+    skill = df["Skill"].to_numpy(dtype=object)
+
+    new_conv = np.ones(n, dtype=bool)
+    new_conv[1:] = conv[1:] != conv[:-1]
+
+    # compare every agent/BOT message with the previous agent/BOT message (shifted identity)
+    actor_pos = np.flatnonzero(is_actor)
+    actor_ident = pd.Series(identity[actor_pos], dtype=object)
+    first_in_conv = np.ones(len(actor_pos), dtype=bool)
+    first_in_conv[1:] = conv[actor_pos[1:]] != conv[actor_pos[:-1]]
+    changed = (actor_ident != actor_ident.shift()).to_numpy() & ~first_in_conv
+
+    boundary = new_conv.copy()
+    boundary[actor_pos[changed]] = True
+    segment_id = np.cumsum(boundary) - 1
+    n_segments = segment_id[-1] + 1
+
+    # agent of a segment is its first agent/BOT message, last skill comes from its last one
+    agents = np.full(n_segments, None, dtype=object)
+    last_skills = np.full(n_segments, None, dtype=object)
+    if len(actor_pos):
+        actor_segment = segment_id[actor_pos]
+        starts = np.ones(len(actor_pos), dtype=bool)
+        starts[1:] = actor_segment[1:] != actor_segment[:-1]
+        ends = np.ones(len(actor_pos), dtype=bool)
+        ends[:-1] = starts[1:]
+        agents[actor_segment[starts]] = identity[actor_pos[starts]]
+        last_skills[actor_segment[ends]] = skill[actor_pos[ends]]
+
+    lines = sender.str.capitalize() + ": " + _as_str(df["TEXT"])
+    messages = lines.groupby(segment_id, sort=False).agg("\n".join)
+
+    return pd.DataFrame({
+        "Conversation ID": conv[boundary],
+        "Last Skill": last_skills,
+        "Agent Name ": agents,
+        "Messages": messages.to_numpy(dtype=object),
+    }, columns=SEGMENT_COLUMNS)
+
+def preprocess_data(df):
+    #sort by conversation id and message sent time
+    df=df.sort_values(by=['Conversation ID', 'Message Sent Time'])
+    #drop duplicates
+    df=df.drop_duplicates(subset=['Conversation ID', 'Message Sent Time'],keep='first')
+    return df
+
+def segment_export(df, vectorized=True):
+    """Preprocess export rows and return the segments that contain consumer messages."""
+    df = preprocess_data(df)
+    df = df[df["Message Type"] == "Normal Message"]
+    # vectorized segments the whole frame at once, otherwise walk every conversation row by row
+    if vectorized:
+        segmented_df = segment_frame(df)
+    else:
+        segmented_df = segment_by_conversation(df)
+    # remove segments with no "Consumer:" Messages
+    return segmented_df[segmented_df["Messages"].str.contains("Consumer:")]
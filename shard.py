@@ -0,0 +1,49 @@
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from export_reader import EXPORT_DTYPE, read_blocks
+
+def shard_of(conversation_ids, n_shards):
+    """Shard number of every conversation id, stable across processes and runs."""
+    hashes = pd.util.hash_pandas_object(conversation_ids, index=False).to_numpy()
+    return hashes % n_shards
+
+def partition_export(csv_path, n_shards, shard_dir, chunksize=100_000):
+    """
+    Hash-partition the export by "Conversation ID" into n_shards files of pickled blocks, so every
+    conversation lands whole in one shard. Returns the shard paths.
+    """
+    paths = [os.path.join(shard_dir, f"shard-{i}.pkl") for i in range(n_shards)]
+    files = [open(path, 'wb') for path in paths]
+    try:
+        with pd.read_csv(csv_path, chunksize=chunksize, dtype=EXPORT_DTYPE) as reader:
+            for i, chunk in enumerate(reader):
+                if i == 0:
+                    # every shard gets the columns, even if no conversation hashes to it
+                    for f in files:
+                        pickle.dump(chunk.iloc[:0], f, protocol=pickle.HIGHEST_PROTOCOL)
+                shards = shard_of(chunk["Conversation ID"], n_shards)
+                for shard, part in chunk.groupby(shards):
+                    pickle.dump(part, files[shard], protocol=pickle.HIGHEST_PROTOCOL)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+def read_shard(path):
+    """Load every block of a shard into one DataFrame."""
+    return pd.concat(read_blocks(path), ignore_index=True)
+
+def map_shards(func, shard_paths, processes):
+    """Run func(shard_path) on a process pool and return the results in shard order."""
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(func, shard_paths))
+
+def merge_shards(frames):
+    """
+    Merge per-shard frames into the order a single process produces: conversations sorted by id,
+    the rows of each conversation in their original order.
+    """
+    merged = pd.concat([frame.astype(object) for frame in frames], ignore_index=True)
+    return merged.sort_values("Conversation ID", kind="stable", ignore_index=True)
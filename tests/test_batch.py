@@ -0,0 +1,70 @@
+import csv
+import json
+import os
+import Stage2
+from batch_backend import FakeBatchBackend, no_violation_response
+from Stage2 import batch_paths, ingest_batch, submit_batch
+
+POLICIES = json.dumps({"policies": [{"title": "Refund policy", "relevance_score": 0.95}]})
+
+def write_input(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=["Conversation ID", "Messages", "Results", "Cluster ID"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+def row(conv_id, messages, cluster=""):
+    return {"Conversation ID": conv_id, "Messages": messages, "Results": POLICIES, "Cluster ID": cluster}
+
+def read_input_requests(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_round_trip(tmp_path):
+    input_csv = str(tmp_path / "r2r-results.csv")
+    output_file = str(tmp_path / "processed.json")
+    write_input(input_csv, [
+        row("CH1", "Consumer: hi"),
+        row("CH2", "Consumer: refund please"),
+        row("CH3", "Consumer: hi again", cluster="CH1#0"),
+        row("CH4", "Consumer: fail"),
+    ])
+    def respond(body):
+        if "Consumer: fail" in json.dumps(body):
+            raise RuntimeError("model overloaded")
+        return no_violation_response(body)
+
+    backend = FakeBatchBackend(str(tmp_path / "batches"), respond)
+    batch = submit_batch(input_csv, output_file, "prompt", backend)
+    # the cluster member CH3 is answered by its representative's request
+    assert [r["custom_id"] for r in read_input_requests(batch_paths(output_file)[0])] == ["CH1#0", "CH2#0", "CH4#0"]
+    assert Stage2.poll_batch(output_file, backend)["status"] == "completed"
+
+    ingest_batch(input_csv, output_file, backend)
+    with open(output_file, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    assert [entry["conversation_id"] for entry in entries] == ["CH1", "CH2", "CH3", "CH4"]
+    assert entries[0]["output"]["policy_violated"] is False
+    assert entries[2]["output"] == entries[0]["output"]
+    assert "model overloaded" in entries[3]["output"]["raw"]
+    # the failed request stays out of the checkpoint, so only it is submitted again
+    submit_batch(input_csv, output_file, "prompt", backend)
+    assert [r["custom_id"] for r in read_input_requests(batch_paths(output_file)[0])] == ["CH4#0"]
+
+def test_nothing_to_submit(tmp_path):
+    input_csv = str(tmp_path / "r2r-results.csv")
+    output_file = str(tmp_path / "processed.json")
+    write_input(input_csv, [row("CH1", "Consumer: hi")])
+    backend = FakeBatchBackend(str(tmp_path / "batches"))
+    submit_batch(input_csv, output_file, "prompt", backend)
+    with open(batch_paths(output_file)[1], 'r', encoding='utf-8') as f:
+        state = f.read()
+    files = sorted(os.listdir(tmp_path / "batches"))
+
+    # no row has valid policies: no upload, no batch, the state of the pending batch is kept
+    write_input(input_csv, [{**row("CH1", "Consumer: hi"), "Results": ""}])
+    assert submit_batch(input_csv, output_file, "prompt", backend) is None
+    assert sorted(os.listdir(tmp_path / "batches")) == files
+    assert not os.path.exists(batch_paths(output_file)[0])
+    with open(batch_paths(output_file)[1], 'r', encoding='utf-8') as f:
+        assert f.read() == state
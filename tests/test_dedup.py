@@ -0,0 +1,36 @@
+from dedup import cluster_segments, names_pattern, normalize_segment
+
+AGENTS = ["Sara Ahmed", "John Smith"]
+
+def flow(agent, amount, days):
+    return "\n".join([
+        "Consumer: Hi, I want to hire a maid for my family",
+        f"Bot: Hello :wave: our monthly service fee is {amount} AED and covers the visa processing",
+        "Consumer: How long does the visa take?",
+        f"Bot: The visa is usually ready within {days} working days, I'm transferring you to one of our agents",
+        f"Agent: Hi, this is {agent}, happy to help with the rest of your application",
+    ])
+
+def other_flow():
+    return "\n".join([
+        "Consumer: My maid is sick, what should I do?",
+        "Bot: Please ask her to describe her symptoms so we can decide whether a clinic visit is needed",
+        "Consumer: She has a fever since yesterday",
+        "Bot: I'm sharing the clinic link with you, the doctor visit is covered by us",
+    ])
+
+def test_templated_flows_cluster_and_other_flows_stay_apart():
+    texts = [flow("Sara Ahmed", "1,500", 5), other_flow(), flow("John Smith", "2,000", 10), flow("Sara", "1,500", 7)]
+    assert cluster_segments(texts, threshold=0.9, names=AGENTS).tolist() == [0, 1, 0, 0]
+
+def test_names_are_not_masked_without_names():
+    texts = [flow("Sara Ahmed", "1,500", 5), flow("John Smith", "1,500", 5)]
+    assert normalize_segment(texts[0]) != normalize_segment(texts[1])
+    pattern = names_pattern(AGENTS)
+    assert normalize_segment(texts[0], pattern) == normalize_segment(texts[1], pattern)
+
+def test_consumer_names_are_not_masked():
+    pattern = names_pattern(AGENTS)
+    assert "mariam" in normalize_segment("Bot: Hello Mariam, how can I help?", pattern)
+    # single name words are only masked capitalized, "will" stays a word
+    assert normalize_segment("Agent: Sara will call you", pattern) == ["agent", "<name>", "will", "call", "you"]
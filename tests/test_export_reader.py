@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from export_reader import iter_conversation_blocks, read_export
+from segment import segment_export
+
+def write_export(path, seed=0, n_conversations=40):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for c in range(n_conversations):
+        # numeric looking ids and messages, agent names missing in whole stretches of the file
+        conv_id = str(rng.integers(1, 10 ** 4)) if c % 3 else f"{c:04d}"
+        for m in range(rng.integers(1, 8)):
+            sender = ["Consumer", "Bot", "Agent"][m % 3]
+            agent = "Sara Ahmed" if sender == "Agent" and c > n_conversations // 2 else np.nan
+            text = str(rng.integers(100)) if rng.random() < 0.3 else f"message {m}"
+            rows.append([conv_id, f"2025-01-01 10:{m:02d}:00", sender, agent, "CC_SALES", text, "Normal Message"])
+    rows = [rows[i] for i in rng.permutation(len(rows))]
+    pd.DataFrame(rows, columns=["Conversation ID", "Message Sent Time", "Sent By", "Agent Name ", "Skill", "TEXT", "Message Type"]).to_csv(path, index=False)
+
+def normalized(df):
+    # blocks without any agent segment hold None where the whole-file frame holds NaN
+    df = df.astype(object).reset_index(drop=True)
+    return df.where(df.notna(), None)
+
+def assert_same_segments(left, right):
+    pd.testing.assert_frame_equal(normalized(left), normalized(right))
+
+def chunked_segments(path, **kwargs):
+    blocks = [segment_export(block) for block in iter_conversation_blocks(path, **kwargs)]
+    return pd.concat(blocks, ignore_index=True)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_chunked_and_in_memory_segmentation_agree(tmp_path, seed):
+    path = str(tmp_path / "export.csv")
+    write_export(path, seed)
+    expected = segment_export(read_export(path))
+    for chunksize in (7, 50, 10_000):
+        assert_same_segments(chunked_segments(path, chunksize=chunksize, tmp_dir=str(tmp_path)), expected)
+
+def test_sorted_export_agrees(tmp_path):
+    path = str(tmp_path / "export.csv")
+    write_export(path)
+    sorted_path = str(tmp_path / "sorted.csv")
+    read_export(path).sort_values("Conversation ID", kind="stable").to_csv(sorted_path, index=False)
+    expected = segment_export(read_export(sorted_path))
+    assert_same_segments(chunked_segments(sorted_path, chunksize=9, sorted_export=True), expected)
+
+def test_ids_and_messages_are_read_as_text(tmp_path):
+    path = str(tmp_path / "export.csv")
+    write_export(path)
+    df = read_export(path)
+    assert df["Conversation ID"].str.len().min() >= 1
+    assert "0000" in set(df["Conversation ID"])
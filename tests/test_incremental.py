@@ -0,0 +1,30 @@
+import pandas as pd
+from incremental import clustered_on, load_state, scan_export
+
+def test_clustered_on():
+    frame = pd.DataFrame({
+        "Conversation ID": ["CH1", "CH2", "CH3", "CH4"],
+        "Cluster ID": ["CH1#0", "CH1#0", "CH3#0", "CH2#0"],
+    })
+    assert clustered_on(frame, {"CH1"}) == {"CH1", "CH2"}
+    assert clustered_on(frame, {"CH4"}) == set()
+    assert clustered_on(frame.drop(columns="Cluster ID"), {"CH1"}) == set()
+    assert clustered_on(None, {"CH1"}) == set()
+
+def test_scan_export_misses_late_messages_before_the_watermark(tmp_path):
+    export = tmp_path / "export.csv"
+    pd.DataFrame({
+        "Conversation ID": ["CH1", "CH2"],
+        "Message Sent Time": ["2025-01-01 10:00:00", "2025-01-01 11:00:00"],
+    }).to_csv(export, index=False)
+    state = load_state(str(tmp_path / "state.json"))
+    ids, watermark = scan_export(str(export), state)
+    assert ids == {"CH1", "CH2"}
+    state = {"watermark": watermark, "conversations": ids}
+
+    pd.DataFrame({
+        "Conversation ID": ["CH1", "CH2", "CH1", "CH3"],
+        "Message Sent Time": ["2025-01-01 10:00:00", "2025-01-01 11:00:00", "2025-01-01 10:30:00", "2025-01-01 09:00:00"],
+    }).to_csv(export, index=False)
+    # the late message of CH1 is older than the watermark, only the new conversation is found
+    assert scan_export(str(export), state)[0] == {"CH3"}
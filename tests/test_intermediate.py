@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+from intermediate import FrameSink, read_frame, write_frame
+
+pytest.importorskip("pyarrow")
+
+def frame():
+    return pd.DataFrame({
+        "Conversation ID": ["CH1", "CH2", "CH3"],
+        "Messages": ["Consumer: hi", None, "Consumer: bye"],
+        "Count": [3, 1, 2],
+        "Score": [0.5, None, 0.25],
+        "Transferred": [True, False, True],
+        "Sent": pd.to_datetime(["2025-01-01 10:00", "2025-01-02 11:00", None]),
+    })
+
+def test_arrow_keeps_dtypes(tmp_path):
+    basename = str(tmp_path / "frame")
+    write_frame(frame(), basename)
+    df = read_frame(basename)
+    assert isinstance(df["Conversation ID"].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_string_dtype(df["Messages"])
+    assert df["Count"].dtype == "int64"
+    assert df["Score"].dtype == "float64"
+    assert df["Transferred"].dtype == bool
+    assert pd.api.types.is_datetime64_any_dtype(df["Sent"])
+    pd.testing.assert_frame_equal(df.astype({"Conversation ID": object}), frame(), check_dtype=False)
+
+def test_csv_copy_is_text(tmp_path):
+    basename = str(tmp_path / "frame")
+    write_frame(frame(), basename)
+    with open(f"{basename}.csv", 'r', encoding='utf-8') as f:
+        assert f.readlines()[1].strip() == "CH1,Consumer: hi,3,0.5,True,2025-01-01 10:00:00"
+
+def test_blocks_follow_the_first_schema(tmp_path):
+    basename = str(tmp_path / "frame")
+    columns = ["Conversation ID", "Count"]
+    with FrameSink(basename, columns, csv=False) as sink:
+        sink.write(pd.DataFrame({"Conversation ID": ["CH1"], "Count": [1]}))
+        sink.write(pd.DataFrame({"Conversation ID": ["CH2", "CH3"], "Count": [2.0, None]}))
+    df = read_frame(basename)
+    assert df["Count"].tolist()[:2] == [1, 2]
+    assert pd.isna(df["Count"].iloc[2])
+
+def test_empty_sink(tmp_path):
+    basename = str(tmp_path / "frame")
+    with FrameSink(basename, ["Conversation ID", "Messages"]):
+        pass
+    assert read_frame(basename).columns.tolist() == ["Conversation ID", "Messages"]
+    assert len(read_frame(basename, arrow=False)) == 0
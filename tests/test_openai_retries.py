@@ -0,0 +1,75 @@
+import time
+from email.utils import formatdate
+import pytest
+import requests
+import Stage2
+from mock_servers import MockServer, mock_openai, openai_chat_response
+
+def scripted(statuses):
+    """respond() answering with the given (status, headers) pairs first, then like the mock OpenAI server."""
+    calls = []
+
+    def respond(path, body):
+        calls.append(path)
+        if len(calls) <= len(statuses):
+            status, headers = statuses[len(calls) - 1]
+            return status, {"error": {"message": "scripted"}}, headers
+        return openai_chat_response(path, body)
+    return respond
+
+@pytest.fixture
+def request_body():
+    return Stage2.build_chat_request("Consumer: hi", {"policies": []}, "prompt")
+
+def post(server, monkeypatch, data, **kwargs):
+    monkeypatch.setattr(Stage2, "OPENAI_API_URL", f"{server.url}/v1/chat/completions")
+    return Stage2.post_chat_completion(data, "key", **kwargs)
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retryable_statuses_are_retried(status, monkeypatch, request_body):
+    with MockServer(scripted([(status, {"Retry-After": "0"})] * 2), latency=0) as server:
+        answer = post(server, monkeypatch, request_body)
+    assert server.requests == 3
+    assert '"policy_violated"' in answer
+
+def test_other_errors_are_not_retried(monkeypatch, request_body):
+    with MockServer(scripted([(400, {})]), latency=0) as server:
+        answer = post(server, monkeypatch, request_body)
+    assert server.requests == 1
+    assert answer.startswith("Error:")
+
+def test_gives_up_after_max_retries(monkeypatch, request_body):
+    with mock_openai(latency=0, error_rate=1.0) as server:
+        answer = post(server, monkeypatch, request_body, max_retries=2)
+    assert server.requests == 3
+    assert answer.startswith("Error:")
+
+def test_retry_after_seconds_is_honoured(monkeypatch, request_body):
+    with MockServer(scripted([(429, {"Retry-After": "0.3"})]), latency=0) as server:
+        start = time.monotonic()
+        post(server, monkeypatch, request_body)
+    assert time.monotonic() - start >= 0.3
+
+class FakeResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+def test_retry_delay():
+    assert Stage2.retry_delay(FakeResponse({"Retry-After": "7"}), 0) == 7
+    assert 28 <= Stage2.retry_delay(FakeResponse({"Retry-After": formatdate(time.time() + 30, usegmt=True)}), 0) <= 30
+    assert Stage2.retry_delay(FakeResponse({"Retry-After": formatdate(time.time() - 30, usegmt=True)}), 0) == 0
+    assert Stage2.retry_delay(FakeResponse({"Retry-After": "soon"}), 2, backoff=0.5) == 2.0
+    assert Stage2.retry_delay(None, 3, backoff=1.0) == 8.0
+
+def test_pooled_session_reuses_its_connection(monkeypatch, request_body):
+    with mock_openai(latency=0) as server, Stage2.create_session(pool_size=1) as session:
+        for _ in range(5):
+            post(server, monkeypatch, request_body, session=session)
+    assert server.requests == 5
+    assert len(server.clients) == 1
+
+def test_without_session_every_request_connects(monkeypatch, request_body):
+    with mock_openai(latency=0) as server:
+        for _ in range(3):
+            post(server, monkeypatch, request_body)
+    assert len(server.clients) == 3
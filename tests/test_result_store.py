@@ -0,0 +1,69 @@
+import json
+import pytest
+from result_store import ResultRecord, decode_first_object, iter_json_array, iter_result_records
+
+VALUES = [
+    {"conversation_id": "CH1", "output": {"policy_violated": False, "policies_violated": []}},
+    12345678901234567890,
+    -1.5e-10,
+    'a string with "escapes" \\ , commas, ] and } inside',
+    [1, [2, [3]], {"nested": "array"}],
+    None,
+    True,
+    {"unicode": "مرحبا 👋", "empty": {}},
+]
+
+def write_array(path, values, indent=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(values, f, indent=indent, ensure_ascii=False)
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8, 13, 1 << 16])
+def test_iter_json_array_across_chunk_boundaries(tmp_path, chunk_size, indent):
+    path = tmp_path / "array.json"
+    write_array(path, VALUES, indent)
+    assert list(iter_json_array(path, chunk_size=chunk_size)) == VALUES
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 1 << 16])
+def test_iter_json_array_empty(tmp_path, chunk_size):
+    path = tmp_path / "array.json"
+    path.write_text(" [ \n ] ", encoding='utf-8')
+    assert list(iter_json_array(path, chunk_size=chunk_size)) == []
+
+@pytest.mark.parametrize("text", ['{"a": 1}', '[1, 2', '[1 2]'])
+def test_iter_json_array_rejects_invalid_input(tmp_path, text):
+    path = tmp_path / "array.json"
+    path.write_text(text, encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(iter_json_array(path, chunk_size=2))
+
+POLICIES = {"policies": [{"title": "Refund policy", "relevance_score": 0.95}]}
+
+@pytest.mark.parametrize("text", [
+    json.dumps(POLICIES),
+    "```json\n" + json.dumps(POLICIES, indent=2) + "\n```",
+    "Here are the relevant policies: " + json.dumps(POLICIES) + " Let me know if you need more.",
+    "The {braces} in this sentence are not JSON. " + json.dumps(POLICIES),
+    json.dumps(POLICIES) + "\n" + json.dumps({"policies": []}),
+])
+def test_decode_first_object(text):
+    assert decode_first_object(text) == POLICIES
+
+@pytest.mark.parametrize("text", ["", None, "no json here", "[1, 2]", "{not json}"])
+def test_decode_first_object_without_object(text):
+    assert decode_first_object(text) is None
+
+def test_prose_wrapped_policies_fill_the_record():
+    record = ResultRecord.from_row({"Conversation Id": "CH1", "Policies": "Policies: " + json.dumps(POLICIES)})
+    assert record.policies == POLICIES["policies"]
+    assert record.high_relevance_titles == ["Refund policy"]
+
+def test_duplicate_conversations_take_their_nth_entry():
+    rows = [{"Conversation Id": "CH1", "Messages": "first"}, {"Conversation Id": "CH2"}, {"Conversation Id": "CH1", "Messages": "second"}]
+    entries = [
+        {"conversation_id": "CH1", "output": {"n": 0}},
+        {"conversation_id": "CH2", "output": {"n": 1}},
+        {"conversation_id": "CH1", "output": {"n": 2}},
+    ]
+    records = list(iter_result_records(rows, entries))
+    assert [(record.messages, record.output) for record in records] == [("first", {"n": 0}), ("", {"n": 1}), ("second", {"n": 2})]
@@ -0,0 +1,80 @@
+import csv
+import json
+import os
+import pytest
+import Stage2
+from mock_servers import MockServer, openai_chat_response
+from Stage2 import process_csv
+
+POLICIES = json.dumps({"policies": [{"title": "Refund policy", "relevance_score": 0.95}]})
+
+def write_input(path, chats):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=["Conversation ID", "Messages", "Results"])
+        writer.writeheader()
+        for i, chat in enumerate(chats):
+            # the second conversation has no valid policies, a permanent failure
+            writer.writerow({"Conversation ID": f"CH{i}", "Messages": chat, "Results": "" if i == 1 else POLICIES})
+
+def checkpointed(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return {json.loads(line)["key"] for line in f}
+
+class Server:
+    """Mock OpenAI server recording the chats it evaluates; chats in reject get a 400 answer."""
+
+    def __init__(self):
+        self.chats = []
+        self.reject = set()
+
+    def respond(self, path, body):
+        chat = body["messages"][1]["content"].split("\n")[0][len("Messages: "):]
+        self.chats.append(chat)
+        if chat in self.reject:
+            return 400, {"error": {"message": "rejected"}}
+        return openai_chat_response(path, body)
+
+def test_resume_evaluates_only_pending_rows(tmp_path, monkeypatch):
+    input_csv = str(tmp_path / "r2r-results.csv")
+    output_file = str(tmp_path / "processed.json")
+    checkpoint_file = str(tmp_path / "processed.jsonl")
+    chats = [f"Consumer: question {i}" for i in range(8)]
+    write_input(input_csv, chats)
+    server = Server()
+    server.reject.add(chats[5])
+    call_openai_api = Stage2.call_openai_api
+
+    def interrupted(*args, **kwargs):
+        if len(server.chats) >= 3:
+            raise KeyboardInterrupt
+        return call_openai_api(*args, **kwargs)
+
+    with MockServer(server.respond, latency=0) as mock:
+        monkeypatch.setattr(Stage2, "OPENAI_API_URL", f"{mock.url}/v1/chat/completions")
+        # first run, killed after three evaluations
+        monkeypatch.setattr(Stage2, "call_openai_api", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            process_csv(input_csv, output_file, "prompt", "key", checkpoint_file=checkpoint_file)
+        done = checkpointed(checkpoint_file)
+        assert "CH1#0" in done
+        assert len(done) >= 3
+
+        # second run: only the pending rows are evaluated, the rejected one stays out of the checkpoint
+        monkeypatch.setattr(Stage2, "call_openai_api", call_openai_api)
+        server.chats.clear()
+        process_csv(input_csv, output_file, "prompt", "key", checkpoint_file=checkpoint_file)
+        assert sorted(server.chats) == [chat for i, chat in enumerate(chats) if f"CH{i}#0" not in done]
+        assert checkpointed(checkpoint_file) == {f"CH{i}#0" for i in range(8)} - {"CH5#0"}
+
+        # third run: only the rejected row is evaluated again, then the checkpoint is removed
+        server.reject.clear()
+        server.chats.clear()
+        process_csv(input_csv, output_file, "prompt", "key", checkpoint_file=checkpoint_file)
+        assert server.chats == [chats[5]]
+        assert not os.path.exists(checkpoint_file)
+
+    with open(output_file, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    assert [entry["conversation_id"] for entry in entries] == [f"CH{i}" for i in range(8)]
+    assert entries[1]["output"] == {"error": f"Error: {Stage2.NO_POLICIES_ERROR}"}
+    assert all("policy_violated" in entry["output"] for i, entry in enumerate(entries) if i != 1)
@@ -0,0 +1,97 @@
+import json
+import time
+from types import SimpleNamespace
+import pytest
+from r2r import R2RClient, R2RException
+from cache import ResponseCache
+from mock_servers import MockServer, mock_r2r, r2r_rag_response
+from retrieval import RAG_PROMPT, TokenBucket, iter_policies, rag_with_retries
+
+DOCUMENT_ID = "doc"
+
+def expected_completion(chat):
+    return r2r_rag_response("/", {"query": RAG_PROMPT.format(chat=chat)})[1]["results"]["completion"]
+
+def test_transient_errors_are_retried():
+    with mock_r2r(latency=0, error_rate=0.5, seed=1) as server:
+        client = R2RClient(base_url=server.url)
+        chats = [f"Consumer: question {i}" for i in range(10)]
+        for chat in chats:
+            assert rag_with_retries(client, chat, DOCUMENT_ID, max_retries=10, backoff=0.001) == expected_completion(chat)
+        assert server.errors > 0
+        assert server.requests == len(chats) + server.errors
+
+def test_permanent_errors_are_raised():
+    with MockServer(r2r_rag_response, latency=0, error_rate=1.0, error_status=400) as server:
+        client = R2RClient(base_url=server.url)
+        with pytest.raises(R2RException):
+            rag_with_retries(client, "Consumer: hi", DOCUMENT_ID, backoff=0.001)
+        assert server.requests == 1
+
+def test_retries_give_up():
+    with mock_r2r(latency=0, error_rate=1.0) as server:
+        client = R2RClient(base_url=server.url)
+        with pytest.raises(R2RException):
+            rag_with_retries(client, "Consumer: hi", DOCUMENT_ID, max_retries=2, backoff=0.001)
+        assert server.requests == 3
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(20, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # the first call uses the initial token, the other five wait 1/20 s each
+    assert time.monotonic() - start >= 0.2
+
+def test_iter_policies_respects_rate_limit():
+    chats = [f"Consumer: question {i}" for i in range(8)]
+    with mock_r2r(latency=0) as server:
+        client = R2RClient(base_url=server.url)
+        start = time.monotonic()
+        list(iter_policies(client, chats, DOCUMENT_ID, concurrency=8, rate_limit=5))
+        # a burst of 5, then 3 calls at 5 per second
+        assert time.monotonic() - start >= 0.5
+
+def test_iter_policies_yields_every_position_out_of_order():
+    chats = ["Consumer: slow"] + [f"Consumer: question {i}" for i in range(7)]
+
+    def respond(path, body):
+        if "Consumer: slow" in body["query"]:
+            time.sleep(0.3)
+        return r2r_rag_response(path, body)
+
+    with MockServer(respond, latency=0) as server:
+        client = R2RClient(base_url=server.url)
+        results = list(iter_policies(client, chats, DOCUMENT_ID, concurrency=4))
+    positions = [position for position, _ in results]
+    assert sorted(positions) == list(range(len(chats)))
+    assert positions[-1] == 0
+    for position, completion in results:
+        assert completion == expected_completion(chats[position])
+        assert "policies" in json.loads(completion)
+
+class EmptyCompletionClient:
+    """Client whose retrieval.rag answers every query without a completion."""
+
+    def __init__(self):
+        self.requests = 0
+        self.retrieval = self
+
+    def rag(self, query, search_settings):
+        self.requests += 1
+        return SimpleNamespace(results=SimpleNamespace(completion=None))
+
+def test_empty_completions_are_not_cached(tmp_path):
+    client = EmptyCompletionClient()
+    with ResponseCache(str(tmp_path / "cache.sqlite")) as cache:
+        for _ in range(2):
+            assert rag_with_retries(client, "Consumer: hi", DOCUMENT_ID, cache=cache) is None
+        assert client.requests == 2
+        assert cache.stats()["entries"] == 0
+
+def test_cache_ignores_none(tmp_path):
+    with ResponseCache(str(tmp_path / "cache.sqlite")) as cache:
+        cache.set("key", None)
+        assert cache.get("key") is None
+        cache.set("key", "value")
+        assert cache.get("key") == "value"
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from segment import preprocess_data, segment_by_conversation, segment_frame
+
+COLUMNS = ["Conversation ID", "Message Sent Time", "Sent By", "Agent Name ", "Skill", "TEXT", "Message Type"]
+
+def random_export(seed, conversations=40):
+    """Export with missing ids, shuffled rows, single-message conversations and BOT/agent switches."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for c in range(conversations):
+        conv_id = f"CH{c:04d}" if rng.random() > 0.05 else np.nan
+        for m in range(int(rng.integers(1, 8))):
+            sent_by = ["Consumer", "Bot", "Agent", "agent ", "System"][rng.integers(5)]
+            agent = ["Sara", "Omar", np.nan][rng.integers(3)] if sent_by.strip().lower() == "agent" else np.nan
+            rows.append([conv_id, f"2025-01-01T00:{c % 60:02d}:{m:02d}", sent_by, agent,
+                         ["Sales", np.nan][rng.integers(2)], f"message {m}", "Normal Message"])
+    return pd.DataFrame(rows, columns=COLUMNS).sample(frac=1, random_state=seed)
+
+def assert_same_segments(df):
+    expected = segment_by_conversation(df).astype(object).reset_index(drop=True)
+    actual = segment_frame(df).astype(object).reset_index(drop=True)
+    pd.testing.assert_frame_equal(expected, actual)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_segment_frame_matches_loop(seed):
+    assert_same_segments(preprocess_data(random_export(seed)))
+
+def test_segment_frame_matches_loop_on_unsorted_input():
+    assert_same_segments(random_export(1))
+
+def test_bot_agent_switches():
+    df = pd.DataFrame([
+        ["CH1", "t1", "Consumer", np.nan, "Sales", "hi", "Normal Message"],
+        ["CH1", "t2", "Bot", np.nan, "Sales", "hello", "Normal Message"],
+        ["CH1", "t3", "Agent", "Sara", "Visa", "Sara here", "Normal Message"],
+        ["CH1", "t4", "Consumer", np.nan, "Visa", "thanks", "Normal Message"],
+        ["CH1", "t5", "Bot", np.nan, "Visa", "bye", "Normal Message"],
+        ["CH2", "t1", "Consumer", np.nan, "Sales", "alone", "Normal Message"],
+    ], columns=COLUMNS)
+    segments = segment_frame(df)
+    assert segments["Agent Name "].tolist()[:3] == ["BOT", "Sara", "BOT"]
+    assert pd.isna(segments["Agent Name "].iloc[3])
+    assert segments["Messages"].tolist() == [
+        "Consumer: hi\nBot: hello", "Agent: Sara here\nConsumer: thanks", "Bot: bye", "Consumer: alone"
+    ]
+    assert_same_segments(df)
+
+def test_missing_ids_are_dropped():
+    df = pd.DataFrame([[np.nan, "t1", "Consumer", np.nan, "Sales", "hi", "Normal Message"]], columns=COLUMNS)
+    assert segment_frame(df).empty
+    assert segment_by_conversation(df).empty
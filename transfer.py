@@ -0,0 +1,45 @@
+import re
+import numpy as np
+import pandas as pd
+
+def extract_messages(text, max_messages=3):
+    """
+    Extract up to max_messages from text, where each message starts with 'Agent:', 'Consumer:', or 'Bot:'
+    """
+    # Split by message prefixes and keep the prefix
+    pattern = r'(Agent:|Consumer:|Bot:)'
+    parts = re.split(pattern, text)
+    
+    messages = []
+    for i in range(1, len(parts), 2):  # Skip first empty part, then take prefix + content pairs
+        if i + 1 < len(parts):
+            prefix = parts[i]
+            content = parts[i + 1].strip()
+            if content:  # Only add if there's actual content
+                messages.append(prefix + content)
+                if len(messages) >= max_messages:
+                    break
+    
+    return messages
+
+def detect_transfers(segmented_df, max_messages=3):
+    """BOT segments followed by a human segment, with the first max_messages messages of that segment appended."""
+    grouped = segmented_df.groupby("Conversation ID", sort=False, observed=True)
+    next_agent = grouped["Agent Name "].shift(-1)
+    next_messages = grouped["Messages"].shift(-1)
+    has_next = grouped.cumcount(ascending=False) > 0
+    is_handoff = (segmented_df["Agent Name "] == "BOT") & has_next & (next_agent != "BOT")
+
+    # segments of a conversation are read in order, keep conversations in first-seen order too
+    order = np.argsort(grouped.ngroup().to_numpy()[is_handoff.to_numpy()], kind="stable")
+    transfers = segmented_df[is_handoff].iloc[order].reset_index(drop=True)
+    handoff_messages = next_messages[is_handoff].iloc[order]
+
+    combined = []
+    for current_messages, next_row_messages in zip(transfers["Messages"], handoff_messages):
+        extracted_messages = extract_messages(next_row_messages, max_messages=max_messages)
+        if extracted_messages:
+            current_messages = current_messages + "\n" + "\n".join(extracted_messages)
+        combined.append(current_messages)
+    transfers["Messages"] = pd.Series(combined, index=transfers.index, dtype=object)
+    return transfers